@@ -1,8 +1,9 @@
 
-from typing import Dict, List
+from typing import Dict, List, Optional
 from enum import Enum
 import json
 from obs_websocket_executor import OBSWebsocketExecutor
+from redemption_tracer import mark_current
 import asyncio
 
 
@@ -25,6 +26,8 @@ class Action:
     def parse_actions(actions_obj: dict):
         actions_dict = {}
         for redemption_name, action_spec_list in actions_obj.items():
+            if isinstance(action_spec_list, dict):  # {"actions": [...], "policy": {...}} form
+                action_spec_list = action_spec_list.get('actions')
             if not isinstance(action_spec_list, list):
                 raise ValueError('Action specs must be a list')
             action_spec_entries = []
@@ -35,12 +38,20 @@ class Action:
             actions_dict[redemption_name] = action_spec_entries
         return actions_dict
 
-    async def execute(self, ws_executor: OBSWebsocketExecutor) -> bool:
+    async def execute(self, ws_executor: OBSWebsocketExecutor) -> Optional[str]:
+        mark_current(f'action_start:{self._action_type.value}')
+        try:
+            return await self._execute(ws_executor)
+        finally:
+            mark_current(f'action_end:{self._action_type.value}')
+
+    async def _execute(self, ws_executor: OBSWebsocketExecutor) -> Optional[str]:
         if self._action_type == ActionEnum.SetSceneItemVisibility:
-            await ws_executor.set_scene_item_visibility(*self._args)
+            return await ws_executor.set_scene_item_visibility(*self._args)
         elif self._action_type == ActionEnum.UpdateSourceSettings:
-            await ws_executor.update_source_settings(*self._args)
+            return await ws_executor.update_source_settings(*self._args)
         elif self._action_type == ActionEnum.Wait:
             await asyncio.sleep(float(self._args[0]))
+            return None
         else:
             raise ValueError(f'Unknown action type {self._action_type}')
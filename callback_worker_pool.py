@@ -0,0 +1,336 @@
+from typing import Callable, Dict, List, Optional, Set
+from multiprocessing import shared_memory
+import asyncio
+import inspect
+import multiprocessing
+import pickle
+import queue
+import struct
+import threading
+import zlib
+from pubsub_events import PubSubEvent
+from redemption_tracer import RedemptionTrace, RedemptionTracer
+
+# ring layout: <head u64><tail u64>, then records of <length u32><pickled event>; head and tail only grow
+RING_HEADER = struct.Struct('<QQ')
+RING_POSITION = struct.Struct('<Q')
+RECORD_LENGTH = struct.Struct('<I')
+WRAP_MARKER = 0xFFFFFFFF
+DEFAULT_RING_SIZE = 1 << 20
+WORKER_POLL_INTERVAL = 0.5
+WORKER_STOP_TIMEOUT = 5
+
+RESULT_READY = 'ready'
+RESULT_LOG = 'log'
+RESULT_DONE = 'done'
+
+
+class SharedMemoryRing:
+    # single producer / single consumer byte ring; the producer only moves head, the consumer only moves tail
+    def __init__(self, capacity: int = DEFAULT_RING_SIZE, name: Optional[str] = None):
+        if capacity <= RECORD_LENGTH.size:
+            raise ValueError('Ring capacity is too small to hold a record')
+        self._capacity = capacity
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=RING_HEADER.size + capacity)
+            RING_HEADER.pack_into(self._shm.buf, 0, 0, 0)
+            self._owner = True
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        self._data = self._shm.buf[RING_HEADER.size:RING_HEADER.size + capacity]
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def write(self, payload: bytes) -> bool:
+        # returns False instead of waiting when the consumer has fallen a full ring behind
+        head, tail = RING_HEADER.unpack_from(self._shm.buf, 0)
+        needed = RECORD_LENGTH.size + len(payload)
+        offset = head % self._capacity
+        skip = self._capacity - offset if self._capacity - offset < needed else 0
+        if head + skip + needed - tail > self._capacity:
+            return False
+        if skip > 0:
+            if skip >= RECORD_LENGTH.size:
+                RECORD_LENGTH.pack_into(self._data, offset, WRAP_MARKER)
+            head += skip
+            offset = 0
+        RECORD_LENGTH.pack_into(self._data, offset, len(payload))
+        start = offset + RECORD_LENGTH.size
+        self._data[start:start + len(payload)] = payload
+        RING_POSITION.pack_into(self._shm.buf, 0, head + needed)
+        return True
+
+    def read(self) -> Optional[bytes]:
+        head, tail = RING_HEADER.unpack_from(self._shm.buf, 0)
+        if tail == head:
+            return None
+        offset = tail % self._capacity
+        if self._capacity - offset < RECORD_LENGTH.size or \
+                RECORD_LENGTH.unpack_from(self._data, offset)[0] == WRAP_MARKER:
+            tail += self._capacity - offset
+            offset = 0
+        length, = RECORD_LENGTH.unpack_from(self._data, offset)
+        start = offset + RECORD_LENGTH.size
+        payload = bytes(self._data[start:start + length])
+        RING_POSITION.pack_into(self._shm.buf, RING_POSITION.size, tail + RECORD_LENGTH.size + length)
+        return payload
+
+    def close(self):
+        self._data.release()
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def _load_worker_callbacks(config: dict, obs_executor, log_callback: Callable[[str, ], None]):
+    from redemption_session import load_actions
+    from twitch_websocket_event_callbacks import TwitchWebsocketEventCallbacks
+    actions_dict, reward_policies = load_actions(config.get('actions', 'actions.json'))
+    return TwitchWebsocketEventCallbacks(obs_executor, actions_dict, log_callback, reward_policies=reward_policies)
+
+
+async def _run_worker(index: int, ring_name: str, ring_size: int, ready: multiprocessing.Semaphore,
+                      stop_event: multiprocessing.Event, result_queue: multiprocessing.Queue, config: dict):
+    from obs_supervisor import OBSSupervisor
+
+    def log(message: str):
+        result_queue.put((index, RESULT_LOG, message))
+
+    # each worker owns its own OBS connections; nothing but the ring and result queue is shared
+    obs_supervisor = OBSSupervisor.from_config(config, log)
+    if not await obs_supervisor.connect():
+        log('Unable to connect to OBS yet; retrying in the background')
+    callback_obj = _load_worker_callbacks(config, obs_supervisor, log)
+    callbacks = callback_obj.list_callbacks()
+    admission_filters = callback_obj.list_admission_filters()
+    tracer = RedemptionTracer()  # only used to activate traces so action spans are collected here
+    ring = SharedMemoryRing(ring_size, ring_name)
+    loop = asyncio.get_running_loop()
+    admitted = asyncio.Queue()
+
+    async def read_ring():
+        # admission runs as events leave the ring, not when they run, so redemptions arriving
+        # behind a running action see it pending and can be coalesced or capped
+        while not stop_event.is_set():
+            if not await loop.run_in_executor(None, ready.acquire, True, WORKER_POLL_INTERVAL):
+                continue
+            record = ring.read()
+            if record is None:
+                continue
+            seq, event, user_ids = pickle.loads(record)
+            admit = admission_filters.get(event.topic)
+            if admit is not None and not admit(event, user_ids):
+                result_queue.put((index, RESULT_DONE, (seq, None, None)))
+                continue
+            trace = RedemptionTrace(event.topic, getattr(event, 'reward_title', None), None)
+            trace.mark('worker_dequeue')
+            admitted.put_nowait((seq, event, user_ids, trace))
+
+    async def run_callbacks():
+        while not stop_event.is_set():
+            seq, event, user_ids, trace = await admitted.get()
+            trace_token = tracer.activate(trace)
+            try:
+                callback = callbacks[event.topic]
+                if inspect.iscoroutinefunction(callback):
+                    err_msg = await callback(event, user_ids)
+                else:
+                    err_msg = callback(event, user_ids)
+            except Exception as e:
+                err_msg = f'{type(e).__name__}: {e}'
+            finally:
+                tracer.deactivate(trace_token)
+            result_queue.put((index, RESULT_DONE, (seq, trace.spans, err_msg)))
+
+    result_queue.put((index, RESULT_READY, None))
+    run_task = asyncio.ensure_future(run_callbacks())
+    try:
+        await read_ring()
+    finally:
+        run_task.cancel()
+        await asyncio.wait([run_task])
+        ring.close()
+        await obs_supervisor.disconnect()
+        for reward_title, reasons in sorted(callback_obj.get_suppressed_counts().items()):
+            summary = ', '.join(f'{count} by {reason}' for reason, count in sorted(reasons.items()))
+            log(f'Suppressed redemptions of {reward_title}: {summary}')
+
+
+def _worker_main(index: int, ring_name: str, ring_size: int, ready: multiprocessing.Semaphore,
+                 stop_event: multiprocessing.Event, result_queue: multiprocessing.Queue, config: dict):
+    try:
+        asyncio.run(_run_worker(index, ring_name, ring_size, ready, stop_event, result_queue, config))
+    except Exception as e:
+        result_queue.put((index, RESULT_LOG, f'Callback worker exited with error: {e}'))
+
+
+class CallbackWorkerPool:
+    # events for the given topics are handed to worker processes instead of the transport's callback queue
+    def __init__(self, config: dict, topics: List[str], log_callback: Callable[[str, ], None],
+                 worker_count: int = 2, ring_size: int = DEFAULT_RING_SIZE):
+        if worker_count <= 0:
+            raise ValueError('At least one callback worker is required')
+        self._config = config
+        self._topics = set(topics)
+        self._log_callback = log_callback
+        self._worker_count = worker_count
+        self._ring_size = ring_size
+        self._context = multiprocessing.get_context('spawn')
+        self._rings = []  # type: List[SharedMemoryRing]
+        self._ready = []  # type: List[multiprocessing.Semaphore]
+        self._processes = []  # type: List[multiprocessing.Process]
+        self._stop_event = None  # type: multiprocessing.Event
+        self._result_queue = None  # type: multiprocessing.Queue
+        self._result_thread = None  # type: threading.Thread
+        self._asyncio_loop = None  # type: asyncio.AbstractEventLoop
+        self._traces = {}  # type: Dict[int, RedemptionTrace]
+        self._owners = {}  # type: Dict[int, int]
+        self._dead = set()  # type: Set[int]
+        self._next_seq = 0
+        self._in_flight = 0  # events handed to a worker, tracked in _owners by seq, without a result yet
+        self._dropped = 0
+
+    def pending_callbacks(self) -> int:
+        return self._in_flight
+
+    def handles(self, topic: str) -> bool:
+        # once every worker has died the transport runs these topics in process again
+        return self._asyncio_loop is not None and topic in self._topics and len(self._dead) < self._worker_count
+
+    def start(self):
+        # must be called from the thread running the asyncio loop that results are delivered on
+        self._asyncio_loop = asyncio.get_running_loop()
+        self._stop_event = self._context.Event()
+        self._result_queue = self._context.Queue()
+        for index in range(self._worker_count):
+            ring = SharedMemoryRing(self._ring_size)
+            ready = self._context.Semaphore(0)
+            process = self._context.Process(
+                target=_worker_main,
+                args=(index, ring.name, self._ring_size, ready, self._stop_event, self._result_queue, self._config),
+                daemon=True
+            )
+            process.start()
+            self._rings.append(ring)
+            self._ready.append(ready)
+            self._processes.append(process)
+        self._result_thread = threading.Thread(target=self._read_results, daemon=True)
+        self._result_thread.start()
+        self._log_callback(f'Started {self._worker_count} callback worker processes')
+
+    async def stop(self):
+        if self._asyncio_loop is None:
+            return
+        self._stop_event.set()
+        for ready in self._ready:
+            ready.release()
+        await self._asyncio_loop.run_in_executor(None, self._join_workers)
+        self._result_queue.put(None)
+        await self._asyncio_loop.run_in_executor(None, self._result_thread.join)
+        for ring in self._rings:
+            ring.close()
+        if self._in_flight > 0:
+            self._log_callback(f'{self._in_flight} redemptions were still queued for callback workers at shutdown')
+        if self._dropped > 0:
+            self._log_callback(f'{self._dropped} redemptions were dropped because a callback worker fell behind')
+        self._rings.clear()
+        self._ready.clear()
+        self._processes.clear()
+        self._traces.clear()
+        self._owners.clear()
+        self._dead.clear()
+        self._in_flight = 0
+        self._asyncio_loop = None
+
+    def _join_workers(self):
+        for process in self._processes:
+            process.join(WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    def _route(self, event: PubSubEvent) -> Optional[int]:
+        # one worker per reward keeps its redemptions ordered and its policy state in one place;
+        # rewards of a dead worker move to a live one, the rest keep their worker
+        key = getattr(event, 'reward_title', None) or event.topic
+        index = zlib.crc32(key.encode('utf-8')) % self._worker_count
+        if index not in self._dead:
+            return index
+        alive = [i for i in range(self._worker_count) if i not in self._dead]
+        if len(alive) == 0:
+            return None
+        return alive[index % len(alive)]
+
+    def submit(self, event: PubSubEvent, user_ids: List[int], trace: Optional[RedemptionTrace] = None) -> bool:
+        index = self._route(event)
+        while index is not None and not self._processes[index].is_alive():
+            self._handle_worker_exit(index)
+            index = self._route(event)
+        if index is None:
+            self._log_callback(f'No callback worker is running; dropped {getattr(event, "reward_title", event.topic)}')
+            return False
+        seq = self._next_seq
+        self._next_seq += 1
+        if not self._rings[index].write(pickle.dumps((seq, event, user_ids), pickle.HIGHEST_PROTOCOL)):
+            self._dropped += 1
+            self._log_callback(f'Callback worker {index} is full; dropped {getattr(event, "reward_title", event.topic)}')
+            return False
+        if trace is not None:
+            trace.mark('worker_handoff')
+            self._traces[seq] = trace
+        self._owners[seq] = index
+        self._in_flight += 1
+        self._ready[index].release()
+        return True
+
+    def _read_results(self):
+        while True:
+            try:
+                result = self._result_queue.get(timeout=WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                if not self._stop_event.is_set():
+                    for index, process in enumerate(self._processes):
+                        if not process.is_alive():
+                            self._asyncio_loop.call_soon_threadsafe(self._handle_worker_exit, index)
+                continue
+            if result is None:
+                return
+            self._asyncio_loop.call_soon_threadsafe(self._handle_result, *result)
+
+    def _handle_worker_exit(self, index: int):
+        # whatever was handed to a dead worker is gone; stop counting it and route around the worker
+        if index in self._dead or self._asyncio_loop is None:
+            return
+        self._dead.add(index)
+        lost = [seq for seq, owner in self._owners.items() if owner == index]
+        for seq in lost:
+            del self._owners[seq]
+            self._traces.pop(seq, None)
+        self._in_flight = max(self._in_flight - len(lost), 0)
+        self._log_callback(
+            f'Callback worker {index} exited unexpectedly; {len(lost)} redemptions handed to it were lost'
+        )
+
+    def _handle_result(self, index: int, kind: str, data):
+        if kind == RESULT_LOG:
+            self._log_callback(f'[worker {index}] {data}')
+        elif kind == RESULT_READY:
+            print(f'callback worker {index} ready')
+        elif kind == RESULT_DONE:
+            seq, spans, err_msg = data
+            if self._owners.pop(seq, None) is None:  # already written off when its worker died
+                return
+            self._in_flight = max(self._in_flight - 1, 0)
+            trace = self._traces.pop(seq, None)
+            if trace is not None and spans is not None:  # spans is None when the worker's policy suppressed it
+                trace.spans.extend(spans)
+                trace.tracer.finish(trace)
+            if err_msg is not None:
+                self._log_callback(f'Encountered error processing action: {err_msg}')
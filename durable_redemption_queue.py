@@ -0,0 +1,215 @@
+from typing import Callable, Dict, List, Optional, Set
+import asyncio
+import json
+import queue
+import sqlite3
+import threading
+import time
+from pubsub_events import PubSubEvent, EVENTSUB_EVENT_TYPES
+from redemption_tracer import parse_redeemed_at
+
+DEFAULT_QUEUE_PATH = 'redemptions.db'
+DEFAULT_DRAIN_RATE = 2.0
+DEFAULT_MAX_AGE = 600.0
+FORMAT_PUBSUB = 'pubsub'
+FORMAT_EVENTSUB = 'eventsub'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS redemptions (
+    id INTEGER PRIMARY KEY,
+    topic TEXT NOT NULL,
+    user_ids TEXT NOT NULL,
+    format TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+)
+'''
+
+
+class _QueuedRedemption:
+    __slots__ = ('topic', 'event', 'user_ids', 'created_at')
+
+    def __init__(self, topic: str, event: PubSubEvent, user_ids: List[int], created_at: float):
+        self.topic = topic
+        self.event = event
+        self.user_ids = user_ids
+        self.created_at = created_at
+
+
+class DurableRedemptionQueue:
+    # entries live in memory for dispatch and in sqlite until acknowledged; only the writer thread touches sqlite
+    def __init__(self, path: str, topics: List[str], log_callback: Callable[[str, ], None],
+                 drain_rate: float = DEFAULT_DRAIN_RATE, max_age: float = DEFAULT_MAX_AGE,
+                 obs_available: Optional[Callable[[], bool]] = None):
+        if drain_rate <= 0:
+            raise ValueError('Durable queue drain rate must be positive')
+        self._path = path
+        self._topics = set(topics)
+        self._log_callback = log_callback
+        self._drain_rate = drain_rate
+        self._max_age = max_age
+        self._obs_available = obs_available
+        self._entries = {}  # type: Dict[int, _QueuedRedemption]
+        self._in_flight = set()  # type: Set[int]
+        self._next_id = 1
+        self._ops = queue.SimpleQueue()
+        self._writer_thread = None  # type: Optional[threading.Thread]
+
+    @staticmethod
+    def from_config(config: dict, topics: List[str], log_callback: Callable[[str, ], None],
+                    obs_available: Optional[Callable[[], bool]] = None) -> Optional['DurableRedemptionQueue']:
+        # 'durable_queue' is either a dict of {path, drain_rate, max_age} or any truthy value for defaults
+        queue_config = config.get('durable_queue')
+        if not queue_config:
+            return None
+        if not isinstance(queue_config, dict):
+            queue_config = {}
+        return DurableRedemptionQueue(
+            queue_config.get('path', DEFAULT_QUEUE_PATH),
+            topics,
+            log_callback,
+            drain_rate=queue_config.get('drain_rate', DEFAULT_DRAIN_RATE),
+            max_age=queue_config.get('max_age', DEFAULT_MAX_AGE),
+            obs_available=obs_available
+        )
+
+    def handles(self, topic: str) -> bool:
+        return self._writer_thread is not None and topic in self._topics
+
+    def open(self):
+        connection = sqlite3.connect(self._path, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')  # WAL keeps this safe against crashes of the app itself
+        connection.execute(_SCHEMA)
+        with connection:
+            expired = connection.execute(
+                'DELETE FROM redemptions WHERE created_at < ?', (time.time() - self._max_age, )
+            ).rowcount
+        rows = connection.execute(
+            'SELECT id, topic, user_ids, format, payload, created_at FROM redemptions ORDER BY id'
+        ).fetchall()
+        unreadable = []
+        for entry_id, topic, user_ids, payload_format, payload, created_at in rows:
+            self._next_id = max(self._next_id, entry_id + 1)
+            try:
+                user_ids = json.loads(user_ids)
+                if payload_format == FORMAT_EVENTSUB:
+                    event = PubSubEvent.from_eventsub(topic, user_ids, json.loads(payload))
+                else:
+                    event = PubSubEvent.from_message(topic, user_ids, payload)
+            except ValueError as e:
+                print(f'dropping unreadable queued redemption {entry_id}: {e}')
+                unreadable.append((entry_id, ))
+                continue
+            self._entries[entry_id] = _QueuedRedemption(topic, event, user_ids, created_at)
+        if len(unreadable) > 0:
+            with connection:
+                connection.executemany('DELETE FROM redemptions WHERE id = ?', unreadable)
+        if expired > 0:
+            self._log_callback(f'Discarded {expired} queued redemptions older than {self._max_age:g}s')
+        if len(self._entries) > 0:
+            self._log_callback(f'Loaded {len(self._entries)} queued redemptions from {self._path}')
+        self._writer_thread = threading.Thread(target=self._write_loop, args=(connection, ), daemon=True)
+        self._writer_thread.start()
+
+    def close(self):
+        if self._writer_thread is None:
+            return
+        self._ops.put(None)
+        self._writer_thread.join()
+        self._writer_thread = None
+        self._entries.clear()
+        self._in_flight.clear()
+
+    def put(self, topic: str, event: PubSubEvent, user_ids: List[int], received_at: float) -> int:
+        # never blocks: the row is serialized here, on the loop thread, and written by the next group commit
+        entry_id = self._next_id
+        self._next_id += 1
+        created_at = parse_redeemed_at(getattr(event, 'redeemed_at', None)) or received_at
+        entry = _QueuedRedemption(topic, event, user_ids, created_at)
+        self._entries[entry_id] = entry
+        self._in_flight.add(entry_id)
+        self._ops.put(('put', entry_id, self._row(entry_id, entry)))
+        return entry_id
+
+    def ack(self, entry_id: int):
+        if self._entries.pop(entry_id, None) is None:
+            return
+        self._in_flight.discard(entry_id)
+        self._ops.put(('ack', entry_id, None))
+
+    def fail(self, entry_id: int):
+        # only a failure while OBS is unreachable is kept for the next drain; any other action error would repeat
+        if self._obs_available is not None and not self._obs_available():
+            self._in_flight.discard(entry_id)
+        else:
+            self.ack(entry_id)
+
+    def _is_expired(self, entry: _QueuedRedemption) -> bool:
+        return time.time() - entry.created_at > self._max_age
+
+    def backlog(self) -> List[int]:
+        return sorted(entry_id for entry_id in self._entries if entry_id not in self._in_flight)
+
+    async def drain(self, backlog: List[int], resubmit: Callable[[int, str, PubSubEvent, List[int]], None]):
+        # entries that fail after the backlog was taken wait for the next drain
+        self._log_callback(f'Draining {len(backlog)} queued redemptions at {self._drain_rate:g}/s')
+        expired = 0
+        for entry_id in backlog:
+            entry = self._entries.get(entry_id)
+            if entry is None or entry_id in self._in_flight:
+                continue
+            if self._is_expired(entry):
+                self.ack(entry_id)
+                expired += 1
+                continue
+            self._in_flight.add(entry_id)
+            resubmit(entry_id, entry.topic, entry.event, entry.user_ids)
+            await asyncio.sleep(1 / self._drain_rate)
+        if expired > 0:
+            self._log_callback(f'Discarded {expired} queued redemptions older than {self._max_age:g}s')
+
+    @staticmethod
+    def _row(entry_id: int, entry: _QueuedRedemption) -> tuple:
+        is_eventsub = type(entry.event) in EVENTSUB_EVENT_TYPES.values()
+        return (
+            entry_id,
+            entry.topic,
+            json.dumps(entry.user_ids),
+            FORMAT_EVENTSUB if is_eventsub else FORMAT_PUBSUB,
+            entry.event.raw_message,
+            entry.created_at
+        )
+
+    def _write_loop(self, connection: sqlite3.Connection):
+        # whatever queued up during the previous commit goes into the next one, so bursts share a single fsync
+        closing = False
+        while not closing:
+            batch = [self._ops.get()]
+            while True:
+                try:
+                    batch.append(self._ops.get_nowait())
+                except queue.Empty:
+                    break
+            puts, acks = {}, []
+            for op in batch:
+                if op is None:
+                    closing = True
+                    continue
+                kind, entry_id, row = op
+                if kind == 'put':
+                    puts[entry_id] = row
+                elif entry_id in puts:  # acknowledged before it was ever written
+                    del puts[entry_id]
+                else:
+                    acks.append((entry_id, ))
+            try:
+                with connection:
+                    connection.executemany(
+                        'INSERT OR REPLACE INTO redemptions VALUES (?, ?, ?, ?, ?, ?)',
+                        list(puts.values())
+                    )
+                    connection.executemany('DELETE FROM redemptions WHERE id = ?', acks)
+            except sqlite3.Error as e:
+                print(f'unable to write durable redemption queue: {e}')
+        connection.close()
@@ -110,6 +110,23 @@ class HelixAPIManager:
             pagination_cursor = resp['pagination']['cursor']
         return list(subscriber_dict.values())
 
+    def create_eventsub_subscription(self, subscription_type: str, version: str,
+                                     condition: dict, session_id: str) -> dict:
+        if self._auth_token is None:
+            raise RuntimeError('API Manager has not received an auth token')
+        resp = self._api_session.post(
+            self.TWITCH_API_URL + 'eventsub/subscriptions',
+            json={
+                'type': subscription_type,
+                'version': version,
+                'condition': condition,
+                'transport': {'method': 'websocket', 'session_id': session_id}
+            }
+        )
+        if not resp.ok:
+            raise RuntimeError('Got Error response from twitch: {}: {}'.format(resp.status_code, resp.text))
+        return resp.json()['data'][0]
+
     def is_user_subscribed_by_id(self, broadcaster_id: str, subscriber_id: str) -> bool:
         resp = requests.get(
             self.TWITCH_API_URL + 'subscriptions',
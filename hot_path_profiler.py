@@ -0,0 +1,147 @@
+from typing import Callable, Dict, Optional
+from collections import defaultdict
+import asyncio
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+
+PROFILE_MODE_SAMPLING = 'sampling'
+PROFILE_MODE_DETERMINISTIC = 'deterministic'
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+TRANSPORT_MODULES = ('twitch_pub_sub_client.py', 'twitch_eventsub_client.py')
+
+# label -> (file name suffixes, function name) of the functions on the receive/dispatch/action path
+HOT_PATH_FUNCTIONS = {
+    'receive_loop': (TRANSPORT_MODULES, '_receive_loop'),
+    'frame_handling': (TRANSPORT_MODULES, '_handle_frame'),
+    # json.loads and the routing field scan in pubsub_events._scan_value both decode through raw_decode
+    'json_decode': ((os.path.join('json', 'decoder.py'), ), 'raw_decode'),
+    'process_callbacks': (('twitch_event_transport.py', ), '_process_callbacks'),
+    'action_execute': (('actions.py', ), 'execute'),
+    'obs_call': (('obs_websocket_executor.py', ), '_call')
+}
+
+
+def _frame_label(filename: str, function_name: str) -> str:
+    return f'{os.path.basename(filename)}:{function_name}'
+
+
+def _matches(filename: str, function_name: str, target: tuple) -> bool:
+    return function_name == target[1] and filename.endswith(target[0])  # endswith takes the tuple of suffixes
+
+
+class HotPathProfiler:
+    # nothing is installed while the profiler is off, so the hot path pays no overhead
+    def __init__(self, log_callback: Callable[[str, ], None], output_dir: str = '.',
+                 sample_interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self._log_callback = log_callback
+        self._output_dir = output_dir
+        self._sample_interval = sample_interval
+        self._mode = None  # type: Optional[str]
+        self._started_at = None  # type: Optional[float]
+        self._profile = None  # type: Optional[cProfile.Profile]
+        self._sampler_thread = None  # type: Optional[threading.Thread]
+        self._sampler_stop = threading.Event()
+        self._samples = defaultdict(int)  # type: Dict[str, int]
+        self._stop_handle = None  # type: Optional[asyncio.TimerHandle]
+
+    def is_active(self) -> bool:
+        return self._mode is not None
+
+    def start(self, mode: str = PROFILE_MODE_SAMPLING, duration: float = None):
+        # must be called from the thread running the asyncio loop, since that is the thread profiled
+        if self._mode is not None:
+            raise RuntimeError('Profiler is already running')
+        if mode == PROFILE_MODE_DETERMINISTIC:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        elif mode == PROFILE_MODE_SAMPLING:
+            self._samples.clear()
+            self._sampler_stop.clear()
+            self._sampler_thread = threading.Thread(
+                target=self._sample_loop, args=(threading.get_ident(),), daemon=True
+            )
+            self._sampler_thread.start()
+        else:
+            raise ValueError(f'Unknown profiling mode {mode}')
+        self._mode = mode
+        self._started_at = time.time()
+        if duration is not None and duration > 0:
+            self._stop_handle = asyncio.get_event_loop().call_later(duration, self.stop)
+        self._log_callback(
+            f'Started {mode} profiling' + (f' for {duration:g}s' if duration else '')
+        )
+
+    def stop(self) -> Optional[str]:
+        if self._mode is None:
+            return None
+        if self._stop_handle is not None:
+            self._stop_handle.cancel()
+            self._stop_handle = None
+        mode, self._mode = self._mode, None
+        elapsed = time.time() - self._started_at
+        stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(self._started_at))
+        os.makedirs(self._output_dir, exist_ok=True)
+        if mode == PROFILE_MODE_DETERMINISTIC:
+            self._profile.disable()
+            path = os.path.join(self._output_dir, f'profile_{stamp}.pstats')
+            stats = pstats.Stats(self._profile)
+            stats.dump_stats(path)
+            summary = self._deterministic_summary(stats)
+            self._profile = None
+        else:
+            self._sampler_stop.set()
+            self._sampler_thread.join()
+            self._sampler_thread = None
+            path = os.path.join(self._output_dir, f'profile_{stamp}.collapsed')
+            with open(path, 'w') as out_file:
+                for stack, count in sorted(self._samples.items()):
+                    out_file.write(f'{stack} {count}\n')
+            summary = self._sampling_summary()
+        self._log_callback(f'Wrote {mode} profile covering {elapsed:.1f}s to {path}')
+        for line in summary:
+            self._log_callback(line)
+        return path
+
+    def toggle(self, mode: str = PROFILE_MODE_SAMPLING, duration: float = None) -> Optional[str]:
+        if self.is_active():
+            return self.stop()
+        self.start(mode, duration)
+        return None
+
+    def _sample_loop(self, thread_id: int):
+        while not self._sampler_stop.wait(self._sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code.co_filename, frame.f_code.co_name))
+                frame = frame.f_back
+            if len(stack) > 0:
+                stack.reverse()
+                self._samples[';'.join(stack)] += 1
+
+    def _sampling_summary(self):
+        total = sum(self._samples.values())
+        if total == 0:
+            return ['No profiling samples were collected']
+        lines = [f'{total} samples; share of samples inside each hot path function:']
+        for label, (suffixes, function_name) in HOT_PATH_FUNCTIONS.items():
+            frame_labels = {_frame_label(suffix, function_name) for suffix in suffixes}
+            hits = sum(c for stack, c in self._samples.items() if not frame_labels.isdisjoint(stack.split(';')))
+            lines.append(f'  {label}: {100 * hits / total:.1f}%')
+        return lines
+
+    def _deterministic_summary(self, stats: pstats.Stats):
+        lines = ['Cumulative time inside each hot path function:']
+        for label, target in HOT_PATH_FUNCTIONS.items():
+            calls, cumulative = 0, 0.0
+            for (filename, _, function_name), (_, nc, _, ct, _) in stats.stats.items():
+                if _matches(filename, function_name, target):
+                    calls += nc
+                    cumulative += ct
+            lines.append(f'  {label}: {cumulative * 1000:.1f}ms over {calls} calls')
+        return lines
@@ -7,22 +7,23 @@ import argparse
 import webbrowser
 import multiprocessing
 import json
+import signal
 from auth_management_server import run_auth_server
 from helix_api_manager import HelixAPIManager
 from aiohttp import web
-from twitch_pub_sub_client import TwitchPubSubClient
-from obs_websocket_executor import OBSWebsocketExecutor
 from actions import Action
 from PyQt5.QtWidgets import QApplication
 from redemption_obs_main_window import RedemptionOBSMainWindow
-from twitch_websocket_event_callbacks import TwitchWebsocketEventCallbacks
+from qt_asyncio_loop import QtAsyncioEventLoop
+from hot_path_profiler import HotPathProfiler, PROFILE_MODE_SAMPLING, PROFILE_MODE_DETERMINISTIC
+from redemption_session import RedemptionSession, load_actions
+from reward_policy import RewardPolicy
 
 # future plan: use to make a font nap prevention mechanism?
 # proc on ban of a fontNap alt account
 
 __version__ = '0.1.0'
-TOPICS = ["channel-points-channel-v1.{channel_id}"]
-HEARTBEAT_RATE = 20
+DEFAULT_PROFILE_WINDOW = 30
 
 
 def handle_twitch_auth(client_id):
@@ -44,36 +45,36 @@ def handle_twitch_auth(client_id):
     print('Authentication process complete, closing redirect server')
     return access_token
 
-async def run_websocket_tasks(auth_token, broadcaster_id, config: dict, 
-                              actions_dict: Dict[str, List[Action]]):
-    obsExecutor = OBSWebsocketExecutor(
-        port=config.get('obsws_port', 4444),
-        password=config.get('obsws_password', '')
-    )
-    if not await obsExecutor.connect():
-        print('Unable to connect to OBS! ensure it is running and has OBS Websocket active')
+async def run_websocket_tasks(auth_token, broadcaster_id, config: dict,
+                              actions_dict: Dict[str, List[Action]],
+                              reward_policies: Dict[str, RewardPolicy]):
+    session = RedemptionSession(config, actions_dict, reward_policies, print)
+    err = await session.connect(auth_token, broadcaster_id)
+    if err is not None:
+        print(err)
         return
-    callbackObj = TwitchWebsocketEventCallbacks(
-        obsExecutor, 
-        actions_dict
-    )
-    pubsub_client = TwitchPubSubClient(
-        TOPICS, 
-        auth_token, 
-        broadcaster_id, 
-        callbackObj.list_callbacks(), 
-        heartbeat_rate=HEARTBEAT_RATE
-    )
-    await pubsub_client.run_tasks()
+    install_profiler_signal_handlers(config)
+    await session.run()
+
+
+def install_profiler_signal_handlers(config: dict):
+    # SIGUSR1 toggles a sampling profile, SIGUSR2 a deterministic one
+    if not hasattr(signal, 'SIGUSR1'):
+        return
+    profiler = HotPathProfiler(print, output_dir=config.get('profile_dir', '.'))
+    window = config.get('profile_window', DEFAULT_PROFILE_WINDOW)
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGUSR1, profiler.toggle, PROFILE_MODE_SAMPLING, window)
+    loop.add_signal_handler(signal.SIGUSR2, profiler.toggle, PROFILE_MODE_DETERMINISTIC, window)
 
 
-def bootstrap(config: dict, actions_dict: dict, log_callback: Callable[[str,], None]):
+def bootstrap(config: dict, actions_dict: dict, reward_policies: dict, log_callback: Callable[[str,], None]):
     auth_token = handle_twitch_auth(config['client_id'])
     broadcaster_name = config['broadcaster_name']
     with HelixAPIManager(client_id=config['client_id'], user_token=auth_token) as manager:
         broadcaster_id = manager.get_user_id_by_username(broadcaster_name)
         log_callback(f'Got broadcaster ID {broadcaster_id} for user {broadcaster_name}')
-    asyncio.run(run_websocket_tasks(auth_token, broadcaster_id, config, actions_dict))
+    asyncio.run(run_websocket_tasks(auth_token, broadcaster_id, config, actions_dict, reward_policies))
 
 
 def main(args):
@@ -84,27 +85,42 @@ def main(args):
         default='config.json',
         nargs='?'
     )
+    parser.add_argument(
+        '--headless',
+        action='store_true',
+        help='run without the GUI; send SIGUSR1/SIGUSR2 to toggle sampling/deterministic profiling'
+    )
     result = vars(parser.parse_args(args))
     print(f'starting Twitch Channel Point Monitor {__version__}')
     config_file_path = result['configuration_file_path']
     if not os.path.isfile(config_file_path):
         print(f'Configuration file {config_file_path} does not exist.')
         return 1
-    # with open(config_file_path, 'r') as config_file:
-    #     config = json.load(config_file)  # TODO: handle error on bad formatting
-
-    # if isinstance(config['actions'], str):
-    #     # TODO: handle error on bad formatting here
-    #     actions_dict = Action.parse_actions_from_file(config['actions'])
-    # else:
-    #     actions_dict = Action.parse_actions(config['actions'])
+    if result['headless']:
+        with open(config_file_path, 'r') as config_file:
+            try:
+                config = json.load(config_file)
+            except json.JSONDecodeError as e:
+                print(f'Unable to load config from {config_file_path}: {e}')
+                return 1
+        actions_spec = config.get('actions', 'actions.json')
+        try:
+            actions_dict, reward_policies = load_actions(actions_spec)
+        except (ValueError, TypeError, KeyError, OSError) as e:
+            print(f'Unable to load actions from {actions_spec}: {e}')
+            return 1
+        bootstrap(config, actions_dict, reward_policies, print)
+        return 0
 
     app = QApplication([])
+    loop = QtAsyncioEventLoop(app)
+    asyncio.set_event_loop(loop)
     main_window = RedemptionOBSMainWindow(config_file_path)
     main_window.show()
-    app.exec_()
-
-    # bootstrap(config, actions_dict)
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
     return 0
 
 if __name__ == '__main__':
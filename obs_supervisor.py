@@ -0,0 +1,234 @@
+from typing import Callable, Dict, List, Optional, Tuple
+from collections import deque
+import asyncio
+import time
+from obs_websocket_executor import OBSWebsocketExecutor
+
+OBS_UNAVAILABLE_HOLD = 'hold'
+OBS_UNAVAILABLE_FAIL = 'fail'
+HEALTH_CHECK_INTERVAL = 1.0
+LATENCY_SAMPLES = 500
+
+
+class OBSInstance:
+    def __init__(self, name: str, executor: OBSWebsocketExecutor):
+        self.name = name
+        self.executor = executor
+        self.connected = asyncio.Event()
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.reconnect_task = None  # type: Optional[asyncio.Task]
+        # (deadline, method name, args) of requests waiting for a reconnect under 'hold'
+        self.held = deque()  # type: deque
+
+
+class OBSSupervisor:
+    def __init__(self, executors: List[Tuple[str, OBSWebsocketExecutor]],
+                 log_callback: Callable[[str, ], None],
+                 unavailable_policy: str = OBS_UNAVAILABLE_HOLD,
+                 hold_timeout: float = 30,
+                 initial_backoff: float = 1,
+                 max_backoff: float = 30,
+                 reconnect_callback: Optional[Callable[[str, ], None]] = None):
+        if unavailable_policy not in (OBS_UNAVAILABLE_HOLD, OBS_UNAVAILABLE_FAIL):
+            raise ValueError(f'Unknown OBS unavailable policy {unavailable_policy}')
+        self._instances = [OBSInstance(name, executor) for name, executor in executors]
+        self._log_callback = log_callback
+        self._unavailable_policy = unavailable_policy
+        self._hold_timeout = hold_timeout
+        self._initial_backoff = initial_backoff
+        self._max_backoff = max_backoff
+        self._reconnect_callback = reconnect_callback
+        self._health_task = None  # type: asyncio.Task
+        self._closing = False
+
+    @staticmethod
+    def from_config(config: dict, log_callback: Callable[[str, ], None]) -> 'OBSSupervisor':
+        instance_specs = config.get('obs_instances')
+        if not instance_specs:
+            instance_specs = [{
+                'name': 'obs',
+                'port': config.get('obsws_port', 4444),
+                'password': config.get('obsws_password', '')
+            }]
+        executors = []
+        for i, spec in enumerate(instance_specs):
+            executor = OBSWebsocketExecutor(
+                port=spec.get('port', 4444),
+                password=spec.get('password', ''),
+                host=spec.get('host', 'localhost')
+            )
+            executors.append((spec.get('name', f'obs{i}'), executor))
+        return OBSSupervisor(
+            executors,
+            log_callback,
+            unavailable_policy=config.get('obs_unavailable_policy', OBS_UNAVAILABLE_HOLD),
+            hold_timeout=config.get('obs_hold_timeout', 30)
+        )
+
+    def is_available(self) -> bool:
+        # any connected instance can run an action; the others hold or drop their share
+        return any(i.connected.is_set() for i in self._instances)
+
+    def set_reconnect_callback(self, reconnect_callback: Optional[Callable[[str, ], None]]):
+        self._reconnect_callback = reconnect_callback
+
+    async def connect(self) -> bool:
+        self._closing = False
+        results = await asyncio.gather(*(i.executor.connect() for i in self._instances))
+        for instance, connected in zip(self._instances, results):
+            if connected:
+                instance.connected.set()
+            else:
+                self._log_callback(f'Unable to connect to OBS instance {instance.name} at {instance.executor.url}')
+                self._start_reconnect(instance)
+        self._health_task = asyncio.ensure_future(self._health_check())
+        return any(results)
+
+    async def disconnect(self):
+        self._closing = True
+        to_wait = [i.reconnect_task for i in self._instances if i.reconnect_task is not None]
+        if self._health_task is not None:
+            to_wait.append(self._health_task)
+        for task in to_wait:
+            task.cancel()
+        if len(to_wait) > 0:
+            await asyncio.wait(to_wait)
+        self._health_task = None
+        for instance in self._instances:
+            instance.reconnect_task = None
+            instance.held.clear()
+            if instance.connected.is_set():
+                instance.connected.clear()
+                try:
+                    await instance.executor.disconnect()
+                except Exception as e:
+                    print(f'error disconnecting from OBS instance {instance.name}: {e}')
+
+    def _start_reconnect(self, instance: OBSInstance):
+        instance.connected.clear()
+        if self._closing:
+            return
+        if instance.reconnect_task is None or instance.reconnect_task.done():
+            instance.reconnect_task = asyncio.ensure_future(self._reconnect_loop(instance))
+
+    async def _reconnect_loop(self, instance: OBSInstance):
+        wait_time = self._initial_backoff
+        while not self._closing:
+            await asyncio.sleep(wait_time)
+            if await instance.executor.reconnect() and await self._run_held(instance):
+                instance.connected.set()
+                self._log_callback(f'Reconnected to OBS instance {instance.name}')
+                if self._reconnect_callback is not None:
+                    self._reconnect_callback(instance.name)
+                return
+            print(f'failed to reconnect to OBS instance {instance.name}; retrying in {wait_time} seconds')
+            wait_time = min(wait_time * 2, self._max_backoff)  # exponential backoff
+
+    async def _health_check(self):
+        while not self._closing:
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            for instance in self._instances:
+                if instance.connected.is_set() and not instance.executor.is_connected():
+                    self._log_callback(f'Lost connection to OBS instance {instance.name}; reconnecting...')
+                    self._start_reconnect(instance)
+
+    async def _call_instance(self, instance: OBSInstance, method_name: str, args: tuple) -> Tuple[bool, Optional[str]]:
+        # returns whether the instance handled the request, and its error if it did
+        start = time.perf_counter()
+        try:
+            err = await getattr(instance.executor, method_name)(*args)
+        except Exception as e:
+            self._log_callback(f'Lost connection to OBS instance {instance.name}: {e}')
+            self._start_reconnect(instance)
+            return False, None
+        instance.latencies.append(time.perf_counter() - start)
+        return True, err
+
+    def _hold(self, instance: OBSInstance, method_name: str, args: tuple):
+        # under 'hold' a down instance keeps its own requests, in order, until it reconnects or they expire
+        if self._unavailable_policy != OBS_UNAVAILABLE_HOLD:
+            return
+        now = time.monotonic()
+        self._drop_expired(instance, now)
+        instance.held.append((now + self._hold_timeout, method_name, args))
+
+    def _drop_expired(self, instance: OBSInstance, now: float):
+        expired = 0
+        while len(instance.held) > 0 and instance.held[0][0] < now:
+            instance.held.popleft()
+            expired += 1
+        if expired > 0:
+            self._log_callback(
+                f'Dropped {expired} requests held for OBS instance {instance.name} '
+                f'after {self._hold_timeout} seconds'
+            )
+
+    async def _run_held(self, instance: OBSInstance) -> bool:
+        # returns False if the connection dropped again before everything held was sent
+        while len(instance.held) > 0:
+            self._drop_expired(instance, time.monotonic())
+            if len(instance.held) == 0:
+                break
+            request = instance.held.popleft()
+            _, method_name, args = request
+            try:
+                err = await getattr(instance.executor, method_name)(*args)
+            except Exception as e:
+                instance.held.appendleft(request)
+                print(f'lost OBS instance {instance.name} again while sending held requests: {e}')
+                return False
+            if err is not None:
+                self._log_callback(f'Held request for OBS instance {instance.name} failed: {err}')
+        return True
+
+    async def _wait_for_any_instance(self) -> List[OBSInstance]:
+        waits = [asyncio.ensure_future(i.connected.wait()) for i in self._instances]
+        try:
+            await asyncio.wait(waits, timeout=self._hold_timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for wait in waits:
+                wait.cancel()
+        return [i for i in self._instances if i.connected.is_set()]
+
+    async def _fan_out(self, method_name: str, *args) -> Optional[str]:
+        # healthy instances run the request at once; an error is only returned when no instance could run it
+        live = [i for i in self._instances if i.connected.is_set()]
+        if len(live) == 0:
+            if self._unavailable_policy == OBS_UNAVAILABLE_FAIL:
+                return 'no OBS instance is connected'
+            live = await self._wait_for_any_instance()
+            if len(live) == 0:
+                return f'no OBS instance reconnected within {self._hold_timeout} seconds'
+        for instance in self._instances:
+            if instance not in live:
+                self._hold(instance, method_name, args)
+        results = await asyncio.gather(*(self._call_instance(i, method_name, args) for i in live))
+        handled = [(i, err) for i, (ran, err) in zip(live, results) if ran]
+        if len(handled) == 0:
+            return 'lost connection to every OBS instance'
+        for instance, (ran, _) in zip(live, results):
+            if not ran:
+                self._hold(instance, method_name, args)
+        errors = [f'{i.name}: {err}' for i, err in handled if err is not None]
+        if len(errors) > 0:
+            return '; '.join(errors)
+        return None
+
+    async def set_scene_item_visibility(self, scene_name: str, source_name: str, visible: bool) -> Optional[str]:
+        return await self._fan_out('set_scene_item_visibility', scene_name, source_name, visible)
+
+    async def update_source_settings(self, source_name: str, new_settings: dict) -> Optional[str]:
+        return await self._fan_out('update_source_settings', source_name, new_settings)
+
+    def latency_stats(self) -> Dict[str, dict]:
+        stats = {}
+        for instance in self._instances:
+            values = sorted(instance.latencies)
+            entry = {'connected': instance.connected.is_set(), 'count': len(values)}
+            if len(values) > 0:
+                entry['mean'] = sum(values) / len(values)
+                entry['p50'] = values[len(values) // 2]
+                entry['p95'] = values[min(len(values) - 1, int(len(values) * 0.95))]
+                entry['max'] = values[-1]
+            stats[instance.name] = entry
+        return stats
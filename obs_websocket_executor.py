@@ -1,19 +1,29 @@
 
 from typing import Optional
 import simpleobsws
+from redemption_tracer import mark_current
 
 class OBSWebsocketExecutor:
-    def __init__(self, port: int = 4444, password: str = None):
+    def __init__(self, port: int = 4444, password: str = None, host: str = 'localhost'):
         if password is None:
             password = ''
+        self._url = f'ws://{host}:{port}'
+        self._password = password
+        self._ws = self._create_client()
+
+    def _create_client(self) -> simpleobsws.WebSocketClient:
         ident_params = simpleobsws.IdentificationParameters(ignoreNonFatalRequestChecks=True)
         ident_params.eventSubscriptions = (1 << 0) | (1 << 2) 
-        self._ws = simpleobsws.WebSocketClient(
-            url=f'ws://localhost:{port}',
-            password=password,
+        return simpleobsws.WebSocketClient(
+            url=self._url,
+            password=self._password,
             identification_parameters=ident_params
         )
 
+    @property
+    def url(self) -> str:
+        return self._url
+
     async def connect(self):
         try:
             if not await self._ws.connect():
@@ -22,12 +32,29 @@ class OBSWebsocketExecutor:
             return False
         return await self._ws.wait_until_identified(30)
 
+    async def reconnect(self):
+        try:
+            await self._ws.disconnect()
+        except Exception:
+            pass
+        self._ws = self._create_client()
+        return await self.connect()
+
+    def is_connected(self) -> bool:
+        return self._ws.is_identified()
+
     async def disconnect(self):
         await self._ws.disconnect()
 
+    async def _call(self, request: simpleobsws.Request) -> simpleobsws.RequestResponse:
+        mark_current(f'obs_request:{request.requestType}')
+        ret = await self._ws.call(request)
+        mark_current(f'obs_response:{request.requestType}')
+        return ret
+
     async def set_scene_item_visibility(self, scene_name: str, source_name: str, visible: bool) -> Optional[str]:
         # TODO: update to use GetSceneItemId
-        ret = await self._ws.call(simpleobsws.Request('GetSceneItemList', {'sceneName': scene_name}))
+        ret = await self._call(simpleobsws.Request('GetSceneItemList', {'sceneName': scene_name}))
         if not ret.ok():
             return f'No scene by name "{scene_name}": {ret.requestStatus}'
         source_id = -1
@@ -39,7 +66,7 @@ class OBSWebsocketExecutor:
             return f'Unable to find source of name "{source_name}" for scene "{scene_name}"'
         data = {'sceneName': scene_name, 'sceneItemId': source_id, 'sceneItemEnabled': visible}
         request = simpleobsws.Request('SetSceneItemEnabled', data)
-        ret = await self._ws.call(request)
+        ret = await self._call(request)
         if not ret.ok():
             return f'Got error setting scene item enabled: {ret.requestStatus}'
         return None
@@ -47,7 +74,7 @@ class OBSWebsocketExecutor:
 
     async def update_source_settings(self, source_name: str, new_settings: dict) -> Optional[str]:
         get_settings_request = simpleobsws.Request('GetSourceSettings', {'sourceName': source_name})
-        ret = await self._ws.call(get_settings_request)
+        ret = await self._call(get_settings_request)
         if not ret.ok():
             return f'No source of name "{source_name}" found: {ret.requestStatus}'
         current_settings = ret.responseData
@@ -56,7 +83,7 @@ class OBSWebsocketExecutor:
             'SetSourceSettings',
             data={'sourceName': source_name, 'sourceSettings': current_settings}
         )
-        ret = await self._ws.call(request)
+        ret = await self._call(request)
         if not ret.ok():
             return f'Unable to set source settings: {ret.requestStatus}'
         return None
@@ -0,0 +1,268 @@
+from typing import List, Optional
+import json
+import re
+
+CHANNEL_POINTS_TOPIC = 'channel-points-channel-v1'
+BITS_TOPIC = 'channel-bits-events-v2'
+SUBSCRIPTION_TOPIC = 'channel-subscribe-events-v1'
+TRANSPORT_PUBSUB = 'pubsub'
+TRANSPORT_EVENTSUB = 'eventsub'
+_REWARD_KEY = re.compile(r'"reward"\s*:\s*(?=\{)')
+_REDEEMED_AT_KEY = re.compile(r'"redeemed_at"\s*:\s*(?=")')
+_DECODER = json.JSONDecoder()
+
+
+def _lookup(value, path: tuple, default=None):
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return default
+        value = value[key]
+    return value
+
+
+def _scan_value(raw: str, key_pattern: re.Pattern):
+    # decodes only the value following the first match of key_pattern; json.JSONDecodeError on bad input
+    match = key_pattern.search(raw)
+    if match is None:
+        return None
+    return _DECODER.raw_decode(raw, match.end())[0]
+
+
+class PubSubEvent:
+    # the message body stays an undecoded string until a field that needs it is read
+    __slots__ = ('topic', 'user_ids', '_raw', '_payload')
+
+    def __init__(self, topic: str, user_ids: List[int], raw_message: str = None, payload: dict = None):
+        if raw_message is None and payload is None:
+            raise ValueError('Either raw_message or payload must be given')
+        self.topic = topic
+        self.user_ids = user_ids
+        self._raw = raw_message
+        self._payload = payload
+
+    @property
+    def payload(self) -> dict:
+        if self._payload is None:
+            self._payload = json.loads(self._raw)
+            self._raw = None  # the decoded form replaces the string rather than doubling memory
+        return self._payload
+
+    @property
+    def raw_message(self) -> str:
+        if self._raw is not None:
+            return self._raw
+        return json.dumps(self._payload)
+
+    def _field(self, *path, default=None):
+        return _lookup(self.payload, path, default)
+
+    @staticmethod
+    def from_message(topic: str, user_ids: List[int], raw_message: str) -> 'PubSubEvent':
+        return EVENT_TYPES.get(topic, PubSubEvent)(topic, user_ids, raw_message=raw_message)
+
+    @staticmethod
+    def from_eventsub(topic: str, user_ids: List[int], event: dict) -> 'PubSubEvent':
+        return EVENTSUB_EVENT_TYPES.get(topic, PubSubEvent)(topic, user_ids, payload=event)
+
+
+class ChannelPointsRedemptionEvent(PubSubEvent):
+    __slots__ = ('reward_title', 'redeemed_at')
+
+    def __init__(self, topic: str, user_ids: List[int], raw_message: str = None, payload: dict = None):
+        super().__init__(topic, user_ids, raw_message, payload)
+        # routing only needs the reward title and redeemed_at, so a raw message has just those values decoded
+        try:
+            if self._raw is not None:
+                reward = _scan_value(self._raw, _REWARD_KEY)
+                redeemed_at = _scan_value(self._raw, _REDEEMED_AT_KEY)
+            else:
+                redemption = self._find_redemption()
+                reward = redemption['reward']
+                redeemed_at = redemption.get('redeemed_at')
+            self.reward_title = reward['title']  # type: str
+        except (KeyError, TypeError) as e:
+            raise ValueError(f'malformed channel points redemption: {e}')
+        self.redeemed_at = redeemed_at if isinstance(redeemed_at, str) else None  # type: Optional[str]
+
+    def _find_redemption(self) -> dict:
+        return self.payload['data']['redemption']
+
+    def _redemption_field(self, *path, default=None):
+        try:
+            redemption = self._find_redemption()
+        except (KeyError, TypeError):
+            return default
+        return _lookup(redemption, path, default)
+
+    @property
+    def redemption_id(self) -> Optional[str]:
+        return self._redemption_field('id')
+
+    @property
+    def status(self) -> Optional[str]:
+        return self._redemption_field('status')
+
+    @property
+    def user_input(self) -> Optional[str]:
+        return self._redemption_field('user_input')
+
+    @property
+    def user_id(self) -> Optional[str]:
+        return self._redemption_field('user', 'id')
+
+    @property
+    def user_login(self) -> Optional[str]:
+        return self._redemption_field('user', 'login')
+
+    @property
+    def user_display_name(self) -> Optional[str]:
+        return self._redemption_field('user', 'display_name')
+
+    @property
+    def reward_id(self) -> Optional[str]:
+        return self._redemption_field('reward', 'id')
+
+    @property
+    def reward_cost(self) -> Optional[int]:
+        return self._redemption_field('reward', 'cost')
+
+
+class BitsEvent(PubSubEvent):
+    __slots__ = ()
+
+    @property
+    def user_name(self) -> Optional[str]:
+        return self._field('data', 'user_name')
+
+    @property
+    def bits_used(self) -> int:
+        return self._field('data', 'bits_used', default=0)
+
+    @property
+    def total_bits_used(self) -> int:
+        return self._field('data', 'total_bits_used', default=0)
+
+    @property
+    def chat_message(self) -> Optional[str]:
+        return self._field('data', 'chat_message')
+
+    @property
+    def is_anonymous(self) -> bool:
+        return self._field('is_anonymous', default=False)
+
+
+class SubscriptionEvent(PubSubEvent):
+    __slots__ = ()
+
+    @property
+    def user_name(self) -> Optional[str]:
+        return self._field('user_name')
+
+    @property
+    def display_name(self) -> Optional[str]:
+        return self._field('display_name')
+
+    @property
+    def sub_plan(self) -> Optional[str]:
+        return self._field('sub_plan')
+
+    @property
+    def context(self) -> Optional[str]:
+        return self._field('context')
+
+    @property
+    def cumulative_months(self) -> int:
+        return self._field('cumulative_months', default=0)
+
+    @property
+    def is_gift(self) -> bool:
+        return self._field('is_gift', default=False)
+
+    @property
+    def recipient_user_name(self) -> Optional[str]:
+        return self._field('recipient_user_name')
+
+    @property
+    def sub_message(self) -> Optional[str]:
+        return self._field('sub_message', 'message')
+
+
+class EventSubChannelPointsRedemptionEvent(ChannelPointsRedemptionEvent):
+    # EventSub sends the redemption itself as the event, with flattened user fields
+    __slots__ = ()
+
+    def _find_redemption(self) -> dict:
+        return self.payload
+
+    @property
+    def user_id(self) -> Optional[str]:
+        return self._redemption_field('user_id')
+
+    @property
+    def user_login(self) -> Optional[str]:
+        return self._redemption_field('user_login')
+
+    @property
+    def user_display_name(self) -> Optional[str]:
+        return self._redemption_field('user_name')
+
+
+class EventSubBitsEvent(BitsEvent):
+    __slots__ = ()
+
+    @property
+    def user_name(self) -> Optional[str]:
+        return self._field('user_login')
+
+    @property
+    def bits_used(self) -> int:
+        return self._field('bits', default=0)
+
+    @property
+    def total_bits_used(self) -> int:
+        return self._field('bits', default=0)  # EventSub does not report a running total
+
+    @property
+    def chat_message(self) -> Optional[str]:
+        return self._field('message')
+
+
+class EventSubSubscriptionEvent(SubscriptionEvent):
+    __slots__ = ()
+
+    @property
+    def user_name(self) -> Optional[str]:
+        return self._field('user_login')
+
+    @property
+    def display_name(self) -> Optional[str]:
+        return self._field('user_name')
+
+    @property
+    def sub_plan(self) -> Optional[str]:
+        return self._field('tier')
+
+    @property
+    def context(self) -> Optional[str]:
+        return 'subgift' if self.is_gift else 'sub'
+
+    @property
+    def recipient_user_name(self) -> Optional[str]:
+        return self._field('user_login') if self.is_gift else None
+
+    @property
+    def sub_message(self) -> Optional[str]:
+        return None
+
+
+EVENT_TYPES = {
+    CHANNEL_POINTS_TOPIC: ChannelPointsRedemptionEvent,
+    BITS_TOPIC: BitsEvent,
+    SUBSCRIPTION_TOPIC: SubscriptionEvent
+}
+
+EVENTSUB_EVENT_TYPES = {
+    CHANNEL_POINTS_TOPIC: EventSubChannelPointsRedemptionEvent,
+    BITS_TOPIC: EventSubBitsEvent,
+    SUBSCRIPTION_TOPIC: EventSubSubscriptionEvent
+}
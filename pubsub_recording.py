@@ -0,0 +1,173 @@
+from typing import Iterator, Tuple, Optional, AsyncIterator
+import argparse
+import asyncio
+import mmap
+import os
+import struct
+import sys
+import time
+from pubsub_events import TRANSPORT_PUBSUB, TRANSPORT_EVENTSUB
+
+# file layout: MAGIC, <transport name, NUL padded to 8 bytes>, then records of
+# <receive timestamp f64><payload length u32><utf-8 payload>
+RECORDING_MAGIC = b'TPSREC02'
+LEGACY_RECORDING_MAGIC = b'TPSREC01'  # no transport field; always PubSub frames
+TRANSPORT_FIELD = struct.Struct('8s')
+RECORD_HEADER = struct.Struct('<dI')
+
+
+def _parse_recording_header(header: bytes, path: str) -> Tuple[str, int]:
+    # returns the recorded transport and the offset of the first record
+    magic = header[:len(RECORDING_MAGIC)]
+    if magic == LEGACY_RECORDING_MAGIC:
+        return TRANSPORT_PUBSUB, len(LEGACY_RECORDING_MAGIC)
+    header_size = len(RECORDING_MAGIC) + TRANSPORT_FIELD.size
+    if magic != RECORDING_MAGIC or len(header) < header_size:
+        raise ValueError(f'{path} is not a Twitch event recording')
+    transport, = TRANSPORT_FIELD.unpack_from(header, len(RECORDING_MAGIC))
+    return transport.rstrip(b'\0').decode('utf-8'), header_size
+
+
+class PubSubRecorder:
+    def __init__(self, path: str, transport: str = TRANSPORT_PUBSUB, flush_interval: float = 1.0):
+        self._path = path
+        self._transport = transport
+        self._flush_interval = flush_interval
+        self._last_flush = 0.0
+        is_new = not os.path.isfile(path) or os.path.getsize(path) == 0
+        if not is_new:
+            with open(path, 'rb') as existing:
+                recorded_transport, _ = _parse_recording_header(
+                    existing.read(len(RECORDING_MAGIC) + TRANSPORT_FIELD.size), path
+                )
+            if recorded_transport != transport:
+                raise ValueError(f'{path} holds {recorded_transport} frames, not {transport}')
+        self._file = open(path, 'ab')
+        if is_new:
+            self._file.write(RECORDING_MAGIC)
+            self._file.write(TRANSPORT_FIELD.pack(transport.encode('utf-8')))
+
+    @property
+    def transport(self) -> str:
+        return self._transport
+
+    def write(self, frame: str, received_at: float):
+        payload = frame.encode('utf-8') if isinstance(frame, str) else frame
+        self._file.write(RECORD_HEADER.pack(received_at, len(payload)))
+        self._file.write(payload)
+        if received_at - self._last_flush >= self._flush_interval:
+            self._file.flush()
+            self._last_flush = received_at
+
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class PubSubRecordingReader:
+    def __init__(self, path: str):
+        self._path = path
+        with open(path, 'rb') as rec_file:
+            self._transport, self._records_offset = _parse_recording_header(
+                rec_file.read(len(RECORDING_MAGIC) + TRANSPORT_FIELD.size), path
+            )
+
+    @property
+    def transport(self) -> str:
+        return self._transport
+
+    def __iter__(self) -> Iterator[Tuple[float, str]]:
+        with open(self._path, 'rb') as rec_file:
+            if os.fstat(rec_file.fileno()).st_size <= self._records_offset:
+                return
+            with mmap.mmap(rec_file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                offset = self._records_offset
+                end = len(view)
+                while offset + RECORD_HEADER.size <= end:
+                    received_at, length = RECORD_HEADER.unpack_from(view, offset)
+                    offset += RECORD_HEADER.size
+                    if offset + length > end:
+                        print(f'truncated record at end of {self._path}; stopping replay')
+                        return
+                    yield received_at, view[offset:offset + length].decode('utf-8')
+                    offset += length
+
+
+async def throttled_frames(reader: PubSubRecordingReader,
+                           speed: Optional[float] = 1.0) -> AsyncIterator[Tuple[float, str]]:
+    # speed of None or <= 0 replays as fast as possible
+    first_recorded = None
+    replay_start = time.monotonic()
+    for received_at, frame in reader:
+        if speed is not None and speed > 0:
+            if first_recorded is None:
+                first_recorded = received_at
+            delay = (received_at - first_recorded) / speed - (time.monotonic() - replay_start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        else:
+            await asyncio.sleep(0)
+        yield time.time(), frame
+
+
+def _replay_client(transport: str, callbacks: dict):
+    # an unconnected client of the recorded transport parses the frames exactly as it did live
+    if transport == TRANSPORT_EVENTSUB:
+        from twitch_eventsub_client import TwitchEventSubClient
+        return TwitchEventSubClient([], '', '', '', callbacks, print)
+    if transport == TRANSPORT_PUBSUB:
+        from twitch_pub_sub_client import TwitchPubSubClient
+        return TwitchPubSubClient([], '', '', callbacks, print)
+    raise ValueError(f'Unknown recorded transport {transport}')
+
+
+async def _replay_benchmark(recording_path: str, speed: Optional[float]):
+    from pubsub_events import EVENT_TYPES
+    dispatched = {}
+
+    def count_dispatch(topic):
+        def _count(data, user_ids):
+            dispatched[topic] = dispatched.get(topic, 0) + 1
+        return _count
+
+    transport = PubSubRecordingReader(recording_path).transport
+    client = _replay_client(transport, {t: count_dispatch(t) for t in EVENT_TYPES})
+    start = time.perf_counter()
+    frame_count = await client.replay_recording(recording_path, speed)
+    elapsed = time.perf_counter() - start
+    print(f'replayed {frame_count} {transport} frames in {elapsed:.3f}s '
+          f'({frame_count / max(elapsed, 1e-9):.1f} frames/s)')
+    for topic, count in sorted(dispatched.items()):
+        print(f'  {topic}: {count} callbacks dispatched')
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='replay a recorded PubSub or EventSub session')
+    parser.add_argument('recording_path', help='path of the recording to replay')
+    parser.add_argument(
+        '--speed',
+        type=float,
+        default=0,
+        help='replay speed multiplier; 1 replays in real time, 0 replays unthrottled'
+    )
+    result = vars(parser.parse_args(args))
+    if not os.path.isfile(result['recording_path']):
+        print(f'Recording {result["recording_path"]} does not exist.')
+        return 1
+    try:
+        asyncio.run(_replay_benchmark(result['recording_path'], result['speed']))
+    except ValueError as e:
+        print(f'Unable to replay {result["recording_path"]}: {e}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
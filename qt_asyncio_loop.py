@@ -0,0 +1,142 @@
+from typing import Callable, Dict
+from asyncio import events
+import asyncio
+import math
+import selectors
+import sys
+import threading
+from PyQt5.QtCore import QCoreApplication, QSocketNotifier, QTimer
+
+MAX_TIMER_INTERVAL_MS = 2**31 - 1
+
+
+class _QtSelector(selectors.BaseSelector):
+    # keeps the regular selector for bookkeeping, but lets Qt do the waiting through socket notifiers
+    def __init__(self, wakeup: Callable[[], None]):
+        self._selector = selectors.DefaultSelector()
+        self._wakeup = wakeup
+        self._notifiers = {}  # type: Dict[int, Dict[int, QSocketNotifier]]
+
+    def register(self, fileobj, events, data=None):
+        key = self._selector.register(fileobj, events, data)
+        self._update_notifiers(key.fd, events)
+        return key
+
+    def unregister(self, fileobj):
+        key = self._selector.unregister(fileobj)
+        self._update_notifiers(key.fd, 0)
+        return key
+
+    def modify(self, fileobj, events, data=None):
+        key = self._selector.modify(fileobj, events, data)
+        self._update_notifiers(key.fd, events)
+        return key
+
+    def select(self, timeout=None):
+        # never block here; the Qt event loop already waited for us
+        return self._selector.select(0)
+
+    def get_map(self):
+        return self._selector.get_map()
+
+    def close(self):
+        for fd in list(self._notifiers.keys()):
+            self._update_notifiers(fd, 0)
+        self._selector.close()
+
+    def _update_notifiers(self, fd: int, events: int):
+        notifiers = self._notifiers.setdefault(fd, {})
+        for selector_event, notifier_type in ((selectors.EVENT_READ, QSocketNotifier.Read),
+                                              (selectors.EVENT_WRITE, QSocketNotifier.Write)):
+            notifier = notifiers.get(selector_event)
+            if events & selector_event:
+                if notifier is None:
+                    notifier = QSocketNotifier(fd, notifier_type)
+                    notifier.activated.connect(self._on_activated)
+                    notifiers[selector_event] = notifier
+                notifier.setEnabled(True)
+            elif notifier is not None:
+                notifier.setEnabled(False)
+                notifier.deleteLater()
+                del notifiers[selector_event]
+        if len(notifiers) == 0:
+            del self._notifiers[fd]
+
+    def _on_activated(self, _):
+        self._wakeup()
+
+
+class QtAsyncioEventLoop(asyncio.SelectorEventLoop):
+    def __init__(self, app: QCoreApplication):
+        self._app = app
+        self._tick_deadline = None
+        self._tick_timer = QTimer()
+        self._tick_timer.setSingleShot(True)
+        self._tick_timer.timeout.connect(self._tick)
+        super().__init__(_QtSelector(self._wakeup))
+
+    def _wakeup(self):
+        self._schedule_tick(0)
+
+    def _schedule_tick(self, delay: float):
+        deadline = self.time() + delay
+        if self._tick_timer.isActive() and self._tick_deadline is not None and self._tick_deadline <= deadline:
+            return
+        self._tick_deadline = deadline
+        self._tick_timer.start(min(MAX_TIMER_INTERVAL_MS, max(0, math.ceil(delay * 1000))))
+
+    def _schedule_next_tick(self):
+        if len(self._ready) > 0 or self._stopping:
+            self._schedule_tick(0)
+        elif len(self._scheduled) > 0:
+            self._schedule_tick(max(0.0, self._scheduled[0]._when - self.time()))
+
+    def _tick(self):
+        self._tick_deadline = None
+        if self.is_closed() or not self.is_running():
+            return
+        self._run_once()
+        if self._stopping:
+            self._app.exit(0)
+            return
+        self._schedule_next_tick()
+
+    def call_soon(self, callback, *args, context=None):
+        handle = super().call_soon(callback, *args, context=context)
+        if threading.get_ident() == self._thread_id:
+            self._schedule_tick(0)
+        return handle
+
+    def call_at(self, when, callback, *args, context=None):
+        handle = super().call_at(when, callback, *args, context=context)
+        if threading.get_ident() == self._thread_id:
+            self._schedule_tick(max(0.0, when - self.time()))
+        return handle
+
+    def stop(self):
+        super().stop()
+        if self.is_running():
+            self._schedule_tick(0)
+
+    def run_forever(self):
+        # runs the Qt event loop; asyncio callbacks are driven from Qt timers and socket notifiers
+        self._check_closed()
+        if self.is_running():
+            raise RuntimeError('This event loop is already running')
+        if events._get_running_loop() is not None:
+            raise RuntimeError('Cannot run the event loop while another loop is running')
+        self._thread_id = threading.get_ident()
+        old_agen_hooks = sys.get_asyncgen_hooks()
+        sys.set_asyncgen_hooks(firstiter=self._asyncgen_firstiter_hook,
+                               finalizer=self._asyncgen_finalizer_hook)
+        events._set_running_loop(self)
+        try:
+            self._schedule_tick(0)
+            self._app.exec_()
+        finally:
+            self._tick_timer.stop()
+            self._tick_deadline = None
+            self._stopping = False
+            self._thread_id = None
+            events._set_running_loop(None)
+            sys.set_asyncgen_hooks(*old_agen_hooks)
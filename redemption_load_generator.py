@@ -0,0 +1,243 @@
+from typing import AsyncIterator, Callable, List, Tuple
+from datetime import datetime, timezone
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+from pubsub_events import CHANNEL_POINTS_TOPIC, TRANSPORT_PUBSUB, TRANSPORT_EVENTSUB
+from redemption_tracer import RedemptionTracer
+from twitch_event_transport import TwitchEventTransport
+from twitch_pub_sub_client import TwitchPubSubClient
+from twitch_eventsub_client import EVENTSUB_SUBSCRIPTIONS
+
+LOAD_TEST_CHANNEL_ID = '0'
+REPORT_PERCENTILES = (50, 95, 99)
+DRAIN_POLL_INTERVAL = 0.01
+
+
+def build_redemption_frame(reward_title: str, channel_id: str = LOAD_TEST_CHANNEL_ID) -> str:
+    now = datetime.now(timezone.utc).isoformat()
+    message = {
+        'type': 'reward-redeemed',
+        'data': {
+            'timestamp': now,
+            'redemption': {
+                'id': str(uuid.uuid4()),
+                'user': {'id': '0', 'login': 'loadtest', 'display_name': 'LoadTest'},
+                'channel_id': channel_id,
+                'redeemed_at': now,
+                'reward': {'id': '0', 'channel_id': channel_id, 'title': reward_title},
+                'status': 'UNFULFILLED'
+            }
+        }
+    }
+    return json.dumps({
+        'type': 'MESSAGE',
+        'data': {
+            'topic': f'{CHANNEL_POINTS_TOPIC}.{channel_id}',
+            'message': json.dumps(message)
+        }
+    })
+
+
+def build_eventsub_frame(reward_title: str, channel_id: str = LOAD_TEST_CHANNEL_ID) -> str:
+    now = datetime.now(timezone.utc).isoformat()
+    sub_type, version = EVENTSUB_SUBSCRIPTIONS[CHANNEL_POINTS_TOPIC]
+    return json.dumps({
+        'metadata': {
+            'message_id': str(uuid.uuid4()),
+            'message_type': 'notification',
+            'message_timestamp': now,
+            'subscription_type': sub_type,
+            'subscription_version': version
+        },
+        'payload': {
+            'subscription': {'id': '0', 'type': sub_type, 'version': version, 'status': 'enabled'},
+            'event': {
+                'id': str(uuid.uuid4()),
+                'broadcaster_user_id': channel_id,
+                'broadcaster_user_login': 'benchmark',
+                'broadcaster_user_name': 'Benchmark',
+                'user_id': '0',
+                'user_login': 'loadtest',
+                'user_name': 'LoadTest',
+                'user_input': '',
+                'status': 'unfulfilled',
+                'reward': {'id': '0', 'title': reward_title, 'cost': 1, 'prompt': ''},
+                'redeemed_at': now
+            }
+        }
+    })
+
+
+FRAME_BUILDERS = {
+    TRANSPORT_PUBSUB: build_redemption_frame,
+    TRANSPORT_EVENTSUB: build_eventsub_frame
+}
+
+
+class RedemptionLoadGenerator:
+    # frames go through the given transport's own parse/admission/queue path, next to any live traffic;
+    # they share its reward policy state but are traced separately and never stored in the durable queue
+    def __init__(self, transport: TwitchEventTransport,
+                 reward_titles: List[str], rate: float, duration: float,
+                 log_callback: Callable[[str, ], None]):
+        if len(reward_titles) == 0:
+            raise ValueError('At least one reward must be chosen for a load test')
+        if rate <= 0 or duration <= 0:
+            raise ValueError('Load test rate and duration must be positive')
+        if transport.TRANSPORT not in FRAME_BUILDERS:
+            raise ValueError(f'Cannot build load test frames for the {transport.TRANSPORT} transport')
+        self._transport = transport
+        self._build_frame = FRAME_BUILDERS[transport.TRANSPORT]
+        self._reward_titles = reward_titles
+        self._rate = rate
+        self._duration = duration
+        self._log_callback = log_callback
+        self._tracer = RedemptionTracer(slow_threshold=float('inf'), max_samples=int(rate * duration) + 1)
+        self._sent = 0
+        self._max_queue_depth = 0
+        self._queue_depth_at_send_end = 0
+
+    def _sample_queue_depth(self) -> int:
+        depth = self._transport.pending_callbacks()
+        self._max_queue_depth = max(self._max_queue_depth, depth)
+        return depth
+
+    async def _generate_frames(self) -> AsyncIterator[Tuple[float, str]]:
+        total = int(self._rate * self._duration)
+        start = time.monotonic()
+        for i in range(total):
+            delay = start + i / self._rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield time.time(), self._build_frame(self._reward_titles[i % len(self._reward_titles)])
+            self._sent += 1
+            self._sample_queue_depth()
+        self._queue_depth_at_send_end = self._sample_queue_depth()
+
+    async def run(self) -> dict:
+        self._log_callback(
+            f'Starting load test: {self._rate:g} redemptions/s for {self._duration:g}s '
+            f'across {len(self._reward_titles)} reward(s)'
+        )
+        start = time.perf_counter()
+        await self._transport.dispatch_frames(self._generate_frames(), tracer=self._tracer, durable=False)
+        # dispatch_frames only waits for the in-process queue; worker pool redemptions finish later
+        while self._sample_queue_depth() > 0:
+            await asyncio.sleep(DRAIN_POLL_INTERVAL)
+        elapsed = time.perf_counter() - start
+        latency = self._tracer.overall_percentiles(REPORT_PERCENTILES)
+        # only redemptions that got past admission are traced; the rest were suppressed or dropped
+        completed = latency['count'] if latency is not None else 0
+        return {
+            'sent': self._sent,
+            'completed': completed,
+            'suppressed': self._sent - completed,
+            'elapsed': elapsed,
+            'throughput': self._sent / elapsed if elapsed > 0 else 0.0,
+            'max_queue_depth': self._max_queue_depth,
+            'queue_depth_at_send_end': self._queue_depth_at_send_end,
+            'latency': latency,
+            'rewards': self._tracer.percentiles(REPORT_PERCENTILES)
+        }
+
+
+def format_load_test_report(report: dict) -> List[str]:
+    lines = [
+        f'Load test sent {report["sent"]} redemptions and drained the queue in {report["elapsed"]:.2f}s '
+        f'({report["throughput"]:.2f} redemptions/s)',
+        f'{report["completed"]} redemptions completed, {report["suppressed"]} suppressed or dropped',
+        f'Callback queue depth: max {report["max_queue_depth"]}, '
+        f'{report["queue_depth_at_send_end"]} still queued when sending finished'
+    ]
+
+    def _latency_line(label, stats):
+        return (f'{label}: p50 {stats["p50"] * 1000:.1f}ms, p95 {stats["p95"] * 1000:.1f}ms, '
+                f'p99 {stats["p99"] * 1000:.1f}ms, max {stats["max"] * 1000:.1f}ms')
+
+    if report['latency'] is not None:
+        lines.append(_latency_line('Completion latency', report['latency']))
+    for reward_title, stats in sorted(report['rewards'].items()):
+        lines.append(_latency_line(f'  {reward_title} ({stats["count"]})', stats))
+    return lines
+
+
+async def _run_cli_load_test(config: dict, reward_titles: List[str], rate: float, duration: float) -> int:
+    from obs_supervisor import OBSSupervisor
+    from redemption_session import load_actions
+    from twitch_websocket_event_callbacks import TwitchWebsocketEventCallbacks
+    actions_spec = config.get('actions', 'actions.json')
+    try:
+        actions_dict, reward_policies = load_actions(actions_spec)
+    except (ValueError, TypeError, KeyError, OSError) as e:
+        print(f'Unable to load actions from {actions_spec}: {e}')
+        return 1
+    if len(reward_titles) == 0:
+        reward_titles = sorted(actions_dict.keys())
+    unknown = [t for t in reward_titles if t not in actions_dict]
+    if len(unknown) > 0:
+        print(f'No actions configured for reward(s): {", ".join(unknown)}')
+        return 1
+    obs_supervisor = OBSSupervisor.from_config(config, print)
+    if not await obs_supervisor.connect():
+        print('Unable to connect to OBS! ensure it is running and has OBS Websocket active')
+        await obs_supervisor.disconnect()
+        return 1
+    try:
+        callback_obj = TwitchWebsocketEventCallbacks(
+            obs_supervisor, actions_dict, print, reward_policies=reward_policies
+        )
+        # without a twitch session an unconnected client still gives the real parse/route/queue/dispatch path
+        client = TwitchPubSubClient(
+            [], '', LOAD_TEST_CHANNEL_ID, callback_obj.list_callbacks(), print,
+            admission_filters=callback_obj.list_admission_filters()
+        )
+        generator = RedemptionLoadGenerator(client, reward_titles, rate, duration, print)
+        report = await generator.run()
+    finally:
+        await obs_supervisor.disconnect()
+    for line in format_load_test_report(report):
+        print(line)
+    return 0
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='send synthetic channel point redemptions through the action pipeline')
+    parser.add_argument(
+        'configuration_file_path',
+        help='the path to the configuration file to use',
+        default='config.json',
+        nargs='?'
+    )
+    parser.add_argument('--rate', type=float, default=5, help='redemptions per second')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to generate load for')
+    parser.add_argument(
+        '--reward',
+        action='append',
+        default=[],
+        help='reward title to redeem; may be repeated, defaults to every configured reward'
+    )
+    result = vars(parser.parse_args(args))
+    config_file_path = result['configuration_file_path']
+    if not os.path.isfile(config_file_path):
+        print(f'Configuration file {config_file_path} does not exist.')
+        return 1
+    with open(config_file_path, 'r') as config_file:
+        try:
+            config = json.load(config_file)
+        except json.JSONDecodeError as e:
+            print(f'Unable to load config from {config_file_path}: {e}')
+            return 1
+    try:
+        return asyncio.run(_run_cli_load_test(config, result['reward'], result['rate'], result['duration']))
+    except ValueError as e:
+        print(f'Invalid load test: {e}')
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
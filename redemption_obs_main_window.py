@@ -1,34 +1,28 @@
 
 from typing import Optional, Dict, List
-from threading import Thread
 import multiprocessing
+import queue
 import webbrowser
 from aiohttp import web
 import json
 import asyncio
 from PyQt5.QtWidgets import QMainWindow, QWidget, QGridLayout, \
         QGroupBox, QVBoxLayout, QLineEdit, QHBoxLayout, QLabel, \
-        QPushButton, QTextEdit, QComboBox
+        QPushButton, QTextEdit, QComboBox, QCheckBox
 from PyQt5.QtGui import QIntValidator, QCloseEvent
-from PyQt5.QtCore import pyqtSignal
-from actions import Action
-from twitch_pub_sub_client import TwitchPubSubClient
-from obs_websocket_executor import OBSWebsocketExecutor
 from auth_management_server import run_auth_server
-from twitch_websocket_event_callbacks import TwitchWebsocketEventCallbacks
 from helix_api_manager import HelixAPIManager
+from reward_policy import RewardPolicy
+from hot_path_profiler import HotPathProfiler, PROFILE_MODE_SAMPLING, PROFILE_MODE_DETERMINISTIC
+from redemption_load_generator import RedemptionLoadGenerator, format_load_test_report
+from redemption_session import RedemptionSession, load_actions
 
 DEFAULT_OBS_WS_PORT = '4444'
-TWITCH_AUTH_TOPICS = ["channel-points-channel-v1.{channel_id}"]
 TWITCH_CLIENT_ID = 'piho0ccplzihr1aywpzjv4x79b2wrc'
+AUTH_POLL_INTERVAL = 0.2
 
 
 class RedemptionOBSMainWindow(QMainWindow):
-    _add_log_message_signal = pyqtSignal(str)
-    _load_configuration_complete_signal = pyqtSignal(object, object)
-    _connection_complete_signal = pyqtSignal(bool)
-    _disconnect_complete_signal = pyqtSignal()
-    _action_run_test_complete_signal = pyqtSignal()
     def __init__(self, config_file_path: str, parent: Optional[QWidget] = None) -> None:
         super().__init__(parent)
         self._config_file_path = config_file_path
@@ -40,14 +34,14 @@ class RedemptionOBSMainWindow(QMainWindow):
             "obsws_port": 4444
         }
         self._actions_dict = {}
-        self._connect_thread = None  # type: Thread
-        self._disconnect_thread = None  # type: Thread
-        self._test_action_thread = None  # type: Thread
+        self._reward_policies = {}  # type: Dict[str, RewardPolicy]
+        self._connect_task = None  # type: asyncio.Task
+        self._disconnect_task = None  # type: asyncio.Task
+        self._test_action_task = None  # type: asyncio.Task
+        self._stress_test_task = None  # type: asyncio.Task
+        self._profiler = None  # type: HotPathProfiler
         self._is_connected = False
-        self._obs_executor = None  # type: OBSWebsocketExecutor
-        self._event_callback_obj = None  # type: TwitchWebsocketEventCallbacks
-        self._pubsub_client = None  # type: TwitchPubSubClient
-        self._async_loop = None
+        self._session = None  # type: RedemptionSession
         self._close_disconnect = False
         self.setWindowTitle('Twitch Redemption OBS Manager')
         self._status_bar = self.statusBar()
@@ -92,57 +86,95 @@ class RedemptionOBSMainWindow(QMainWindow):
         self._tester_run_button = QPushButton('Run')
         self._tester_run_button.setDisabled(True)
         tester_layout.addWidget(self._tester_run_button)
+        tester_layout.addWidget(QLabel('Stress Rate (/s):'))
+        self._tester_stress_rate_line_edit = QLineEdit('5')
+        self._tester_stress_rate_line_edit.setValidator(QIntValidator(1, 1000, self._tester_stress_rate_line_edit))
+        tester_layout.addWidget(self._tester_stress_rate_line_edit)
+        tester_layout.addWidget(QLabel('Duration (s):'))
+        self._tester_stress_duration_line_edit = QLineEdit('10')
+        self._tester_stress_duration_line_edit.setValidator(
+            QIntValidator(1, 3600, self._tester_stress_duration_line_edit)
+        )
+        tester_layout.addWidget(self._tester_stress_duration_line_edit)
+        self._tester_stress_all_checkbox = QCheckBox('All Rewards')
+        tester_layout.addWidget(self._tester_stress_all_checkbox)
+        self._tester_stress_button = QPushButton('Stress')
+        self._tester_stress_button.setDisabled(True)
+        tester_layout.addWidget(self._tester_stress_button)
         tester_layout.addStretch()
         self._tester_group_box.setLayout(tester_layout)
         self._main_layout.addWidget(self._tester_group_box, 2, 0, 1, 2)
+        self._profiler_group_box = QGroupBox('Profiler')
+        profiler_layout = QHBoxLayout()
+        profiler_layout.addWidget(QLabel('Mode:'))
+        self._profiler_mode_cbox = QComboBox()
+        self._profiler_mode_cbox.addItems([PROFILE_MODE_SAMPLING, PROFILE_MODE_DETERMINISTIC])
+        profiler_layout.addWidget(self._profiler_mode_cbox)
+        profiler_layout.addWidget(QLabel('Window (s):'))
+        self._profiler_duration_line_edit = QLineEdit('30')
+        self._profiler_duration_line_edit.setValidator(QIntValidator(0, 3600, self._profiler_duration_line_edit))
+        profiler_layout.addWidget(self._profiler_duration_line_edit)
+        self._profiler_button = QPushButton('Start Profiling')
+        profiler_layout.addWidget(self._profiler_button)
+        profiler_layout.addStretch()
+        self._profiler_group_box.setLayout(profiler_layout)
+        self._main_layout.addWidget(self._profiler_group_box, 3, 0, 1, 2)
         self._connect_button.clicked.connect(self._handle_connect_button_clicked)
         self._tester_run_button.clicked.connect(self._handle_tester_run_button_clicked)
-        self._add_log_message_signal.connect(self._on_add_log_message)
-        self._load_configuration_complete_signal.connect(self._handle_load_configuration_complete)
-        self._connection_complete_signal.connect(self._handle_connection_complete)
-        self._disconnect_complete_signal.connect(self._handle_disconnect_complete)
-        self._action_run_test_complete_signal.connect(self._handle_action_run_test_complete)
-        self._config_thread = Thread(target=self._load_configuration)
-        self._config_thread.start()
+        self._tester_stress_button.clicked.connect(self._handle_tester_stress_button_clicked)
+        self._profiler_button.clicked.connect(self._handle_profiler_button_clicked)
+        self._config_task = asyncio.ensure_future(self._load_configuration())
 
     def closeEvent(self, a0: QCloseEvent) -> None:
+        if self._is_connected and not self._close_disconnect:
+            # disconnect without blocking the loop, then close again once done
+            self._close_disconnect = True
+            a0.ignore()
+            self._disconnect_task = asyncio.ensure_future(self._close_after_disconnect())
+            return
         self._close_disconnect = True
-        if self._is_connected:
-            disconnect_thread = Thread(target=self._disconnect_callback)
-            disconnect_thread.start()
-            disconnect_thread.join()
+        if self._profiler is not None and self._profiler.is_active():
+            self._profiler.stop()
+        if self._connect_task is not None and not self._connect_task.done():
+            self._connect_task.cancel()
         return super().closeEvent(a0)
 
-    def _load_configuration(self):
+    async def _close_after_disconnect(self):
+        await self._disconnect_async()
+        self.close()
+
+    async def _load_configuration(self):
         self.add_log_message(f'Loading config from {self._config_file_path}')
         with open(self._config_file_path, 'r') as config_file:
             try:
-                config = json.load(config_file)  # TODO: handle error on bad formatting
+                config = json.load(config_file)
             except json.JSONDecodeError as e:
                 self.add_log_message(f'Unable to load saved config from {self._config_file_path}: {e}.')
                 self.add_log_message('All configuration values will be set to default')
-                self._load_configuration_complete_signal.emit(None, None)
+                self._handle_load_configuration_complete(None, None, None)
                 return
         actions_spec = config['actions']
+        if isinstance(actions_spec, str):
+            self.add_log_message(f'Loading actions from {actions_spec}')
         try:
-            if isinstance(actions_spec, str):
-                self.add_log_message(f'Loading actions from {actions_spec}')
-                actions_dict = Action.parse_actions_from_file(actions_spec)
-            else:
-                actions_dict = Action.parse_actions(actions_spec)
-        except json.JSONDecodeError as e:
+            actions_dict, reward_policies = load_actions(actions_spec)
+        except (ValueError, TypeError, KeyError, OSError) as e:
             self.add_log_message(f'Unable to load actions from {actions_spec}: {e}')
             self.add_log_message(f'No actions will be available.')
-            self._load_configuration_complete_signal.emit(config, None)
+            self._handle_load_configuration_complete(config, None, None)
+            return
         self.add_log_message('Configuration and actions loaded!')
-        self._load_configuration_complete_signal.emit(config, actions_dict)
+        self._handle_load_configuration_complete(config, actions_dict, reward_policies)
 
-    def _handle_load_configuration_complete(self, loaded_config: dict, loaded_actions: dict):
+    def _handle_load_configuration_complete(self, loaded_config: dict, loaded_actions: dict,
+                                            loaded_policies: dict):
         if loaded_config is not None:
             self._config.update(loaded_config)
             self._set_config_ui_values()
         if loaded_actions is not None:
             self._actions_dict = loaded_actions
+        if loaded_policies is not None:
+            self._reward_policies = loaded_policies
         self._connect_button.setDisabled(False)
         action_names = sorted(list(self._actions_dict.keys()))
         self._tester_redemption_name_cbox.addItems(action_names)
@@ -156,71 +188,117 @@ class RedemptionOBSMainWindow(QMainWindow):
         self._connect_button.setDisabled(True)
         if self._is_connected:
             self._status_bar.showMessage('Disconnecting...')
-            Thread(target=self._disconnect_callback).start()
+            self._disconnect_task = asyncio.ensure_future(self._disconnect_async())
         else:
             self._status_bar.showMessage('Connecting...')
-            self._connect_thread = Thread(target=self._connect_callback)
-            self._connect_thread.start()
+            self._connect_task = asyncio.ensure_future(self._connect_async())
 
     def _handle_tester_run_button_clicked(self, _: bool):
         self._tester_run_button.setDisabled(True)
         self._tester_run_button.setText('Running...')
         self._tester_redemption_name_cbox.setDisabled(True)
         redemption_name = self._tester_redemption_name_cbox.currentText()
-        self._test_action_thread = Thread(
-            target=self._run_action_test_callback, args=(redemption_name,)
-        )
-        self._test_action_thread.start()
+        self._test_action_task = asyncio.ensure_future(self._run_action_test(redemption_name))
 
-    def _run_action_test_callback(self, redemption_name: str):
-        if self._async_loop is None or not self._is_connected:
-            raise RuntimeError('Cannot run action tests while disconnected')
-        redemption_obj = {
-            'data': {
-                'redemption': {
-                    'reward': {
-                        'title': redemption_name
-                    }
-                }
-            }
-        }
-        fut = asyncio.run_coroutine_threadsafe(
-            self._event_callback_obj.handle_redemption_reward(redemption_obj, []),
-            self._async_loop
-        )
-        fut.result()
-        self._action_run_test_complete_signal.emit()
+    async def _run_action_test(self, redemption_name: str):
+        if not self._is_connected:
+            self.add_log_message('Cannot run action tests while disconnected')
+            self._handle_action_run_test_complete()
+            return
+        try:
+            err = await self._session.callbacks.test_redemption_reward(redemption_name)
+            if err is not None:
+                self.add_log_message(f'Action test for {redemption_name} failed: {err}')
+        finally:
+            self._handle_action_run_test_complete()
 
     def _handle_connection_complete(self, success: bool):
         if success:
             self._connect_button.setText('Disconnect')
             self._tester_run_button.setDisabled(False)
+            self._tester_stress_button.setDisabled(False)
             self._status_bar.showMessage('Connected')
         else:
             self._status_bar.showMessage('Connection failed!')
         self._connect_button.setDisabled(False)
-        self._connect_thread = None
 
     def _handle_disconnect_complete(self):
         self._connect_button.setText('Connect')
         self._connect_button.setDisabled(False)
         self._status_bar.showMessage('Not Connected')
-        self._disconnect_thread = None
-        self._async_loop = None
+        self._connect_task = None
+        self._disconnect_task = None
 
     def _handle_action_run_test_complete(self):
         self._tester_run_button.setDisabled(False)
         self._tester_run_button.setText('Run')
         self._tester_redemption_name_cbox.setDisabled(False)
 
+    def _handle_profiler_button_clicked(self, _: bool):
+        if self._profiler is None:
+            self._profiler = HotPathProfiler(self._on_profiler_log, output_dir=self._config.get('profile_dir', '.'))
+        if self._profiler.is_active():
+            self._profiler.stop()
+            return
+        duration_text = self._profiler_duration_line_edit.text()
+        duration = int(duration_text) if len(duration_text) > 0 else 0
+        self._profiler.start(self._profiler_mode_cbox.currentText(), duration)
+        self._profiler_button.setText('Stop Profiling')
+        self._profiler_mode_cbox.setDisabled(True)
+
+    def _on_profiler_log(self, message: str):
+        # also fires when a timed window ends on its own
+        self.add_log_message(message)
+        if self._profiler is not None and not self._profiler.is_active():
+            self._profiler_button.setText('Start Profiling')
+            self._profiler_mode_cbox.setDisabled(False)
+
+    def _handle_tester_stress_button_clicked(self, _: bool):
+        if self._tester_stress_all_checkbox.isChecked():
+            reward_titles = sorted(self._actions_dict.keys())
+        else:
+            reward_titles = [self._tester_redemption_name_cbox.currentText()]
+        try:
+            rate = int(self._tester_stress_rate_line_edit.text())
+            duration = int(self._tester_stress_duration_line_edit.text())
+        except ValueError:
+            self.add_log_message('Stress rate and duration must be whole numbers')
+            return
+        self._tester_stress_button.setDisabled(True)
+        self._tester_stress_button.setText('Stressing...')
+        self._stress_test_task = asyncio.ensure_future(self._run_stress_test(reward_titles, rate, duration))
+
+    async def _run_stress_test(self, reward_titles: List[str], rate: int, duration: int):
+        try:
+            if not self._is_connected:
+                self.add_log_message('Cannot run stress tests while disconnected')
+                return
+            try:
+                generator = RedemptionLoadGenerator(
+                    self._session.transport, reward_titles, rate, duration, self.add_log_message
+                )
+            except ValueError as e:
+                self.add_log_message(f'Invalid stress test: {e}')
+                return
+            self.add_log_message(
+                'Stress redemptions share cooldowns, rate limits and coalescing with live redemptions '
+                'and may suppress them until the test finishes'
+            )
+            report = await generator.run()
+            for line in format_load_test_report(report):
+                self.add_log_message(line)
+        finally:
+            self._tester_stress_button.setDisabled(False)
+            self._tester_stress_button.setText('Stress')
+
     def add_log_message(self, message: str):
         if self.isVisible():
-            self._add_log_message_signal.emit(message)
+            self._on_add_log_message(message)
 
     def _on_add_log_message(self, message: str):
         self._log_text_edit.append(message + '\n')
 
-    def _handle_twitch_auth(self, client_id):
+    async def _handle_twitch_auth(self, client_id):
         print('initializing auth redirect server')
         app = web.Application()
         mp_queue = multiprocessing.Queue()
@@ -234,61 +312,62 @@ class RedemptionOBSMainWindow(QMainWindow):
         authorization_url += '&redirect_uri={redirect}'.format(redirect='http://localhost:8000')
         authorization_url += '&scope=channel:read:redemptions'
         webbrowser.open(authorization_url, new=2)
-        access_token = mp_queue.get()
-        http_server_handle.terminate()
-        http_server_handle.join()
+        try:
+            while True:
+                try:
+                    access_token = mp_queue.get_nowait()
+                    break
+                except queue.Empty:
+                    await asyncio.sleep(AUTH_POLL_INTERVAL)
+        finally:
+            http_server_handle.terminate()
+            http_server_handle.join()
         print('Authentication process complete, closing redirect server and starting redemption monitoring')
         return access_token
 
     async def _run_websocket_tasks(self, auth_token, broadcaster_id):
-        self._async_loop = asyncio.get_running_loop()
-        self._obs_executor = OBSWebsocketExecutor(
-            port=self._config['obsws_port'],
-            password=self._config['obsws_password']
+        self._session = RedemptionSession(
+            self._config, self._actions_dict, self._reward_policies, self.add_log_message
         )
-        self.add_log_message('Connecting to OBS Websocket...')
-        if not await self._obs_executor.connect():
-            self.add_log_message('Unable to connect to OBS! ensure it is running and has OBS Websocket active.')
-            self._connection_complete_signal.emit(False)
+        err = await self._session.connect(auth_token, broadcaster_id)
+        if err is not None:
+            self.add_log_message(err)
+            self._handle_connection_complete(False)
             return
-        self.add_log_message('Connected!')
-        self._event_callback_obj = TwitchWebsocketEventCallbacks(
-            self._obs_executor, 
-            self._actions_dict,
-            self.add_log_message
-        )
-        self._pubsub_client = TwitchPubSubClient(
-            TWITCH_AUTH_TOPICS,
-            auth_token, broadcaster_id,
-            self._event_callback_obj.list_callbacks(),
-            self.add_log_message,
-            heartbeat_rate=20
-        )
         self._is_connected = True
-        self._connection_complete_signal.emit(True)
-        self.add_log_message('Starting redemption monitoring...')
-        err = await self._pubsub_client.run_tasks()
-        if err is not None:
-            self.add_log_message(f'Twitch PubSub client encountered an error: {err}')
+        self._handle_connection_complete(True)
+        await self._session.run()
         self.add_log_message('Exiting websocket task')
 
+    def _get_broadcaster_id(self, auth_token: str, broadcaster_name: str) -> str:
+        with HelixAPIManager(client_id=self._config['client_id'], user_token=auth_token) as manager:
+            return manager.get_user_id_by_username(broadcaster_name)
 
-    def _connect_callback(self):
+    async def _connect_async(self):
         if self._is_connected:
             return
-        auth_token = self._handle_twitch_auth(self._config['client_id'])
+        auth_token = await self._handle_twitch_auth(self._config['client_id'])
         broadcaster_name = self._config['broadcaster_name']
         self.add_log_message('Getting broadcaster id...')
-        with HelixAPIManager(client_id=self._config['client_id'], user_token=auth_token) as manager:
-            broadcaster_id = manager.get_user_id_by_username(broadcaster_name)
-            self.add_log_message(f'Got broadcaster ID {broadcaster_id} for user {broadcaster_name}')
-        asyncio.run(self._run_websocket_tasks(auth_token, broadcaster_id))
+        try:
+            # requests based helix calls still block, so they run on the default executor
+            broadcaster_id = await asyncio.get_running_loop().run_in_executor(
+                None, self._get_broadcaster_id, auth_token, broadcaster_name
+            )
+        except RuntimeError as e:
+            self.add_log_message(f'Unable to get broadcaster ID for user {broadcaster_name}: {e}')
+            self._handle_connection_complete(False)
+            return
+        self.add_log_message(f'Got broadcaster ID {broadcaster_id} for user {broadcaster_name}')
+        await self._run_websocket_tasks(auth_token, broadcaster_id)
         if not self._close_disconnect:
             self.add_log_message('Clean exit complete')
 
-    def _disconnect_callback(self):
+    async def _disconnect_async(self):
         if not self._is_connected:
             return
-        self._pubsub_client.disconnect()
+        await self._session.disconnect_async()
+        if self._connect_task is not None:
+            await self._connect_task
         self._is_connected = False
-        self._disconnect_complete_signal.emit()
+        self._handle_disconnect_complete()
@@ -0,0 +1,193 @@
+from typing import Callable, Dict, List, Optional, Tuple
+import sqlite3
+from actions import Action
+from obs_supervisor import OBSSupervisor
+from twitch_websocket_event_callbacks import TwitchWebsocketEventCallbacks
+from twitch_event_transport import TwitchEventTransport
+from twitch_pub_sub_client import TwitchPubSubClient
+from twitch_eventsub_client import TwitchEventSubClient
+from redemption_tracer import RedemptionTracer
+from pubsub_recording import PubSubRecorder
+from pubsub_events import TRANSPORT_PUBSUB, TRANSPORT_EVENTSUB
+from reward_policy import RewardPolicy
+from callback_worker_pool import CallbackWorkerPool
+from durable_redemption_queue import DurableRedemptionQueue
+
+TWITCH_TOPICS = ["channel-points-channel-v1.{channel_id}"]
+HEARTBEAT_RATE = 20
+
+
+def load_actions(actions_spec) -> Tuple[Dict[str, List[Action]], Dict[str, RewardPolicy]]:
+    # raises ValueError (including json errors), TypeError, KeyError or OSError on a bad actions file or spec
+    if isinstance(actions_spec, str):
+        return Action.parse_actions_from_file(actions_spec), RewardPolicy.parse_policies_from_file(actions_spec)
+    return Action.parse_actions(actions_spec), RewardPolicy.parse_policies(actions_spec)
+
+
+class RedemptionSession:
+    # one connected run of OBS plus a twitch transport; the GUI and --headless both build theirs here
+    def __init__(self, config: dict, actions_dict: Dict[str, List[Action]],
+                 reward_policies: Dict[str, RewardPolicy],
+                 log_callback: Callable[[str, ], None]):
+        self._config = config
+        self._actions_dict = actions_dict
+        self._reward_policies = reward_policies
+        self._log_callback = log_callback
+        self.obs = None  # type: Optional[OBSSupervisor]
+        self.callbacks = None  # type: Optional[TwitchWebsocketEventCallbacks]
+        self.tracer = None  # type: Optional[RedemptionTracer]
+        self.transport = None  # type: Optional[TwitchEventTransport]
+        self._recorder = None  # type: Optional[PubSubRecorder]
+        self._worker_pool = None  # type: Optional[CallbackWorkerPool]
+        self._durable_queue = None  # type: Optional[DurableRedemptionQueue]
+
+    async def connect(self, auth_token: str, broadcaster_id: str) -> Optional[str]:
+        # returns an error message if OBS could not be reached; otherwise the session is ready to run
+        try:
+            self.obs = OBSSupervisor.from_config(self._config, self._log_callback)
+        except ValueError as e:
+            return f'Invalid OBS configuration: {e}'
+        self._log_callback('Connecting to OBS Websocket...')
+        if not await self.obs.connect():
+            await self.obs.disconnect()
+            return 'Unable to connect to OBS! ensure it is running and has OBS Websocket active.'
+        self._log_callback('Connected!')
+        self.callbacks = TwitchWebsocketEventCallbacks(
+            self.obs,
+            self._actions_dict,
+            self._log_callback,
+            reward_policies=self._reward_policies
+        )
+        transport = self._config.get('transport', TRANSPORT_PUBSUB)
+        if transport not in (TRANSPORT_PUBSUB, TRANSPORT_EVENTSUB):
+            self._log_callback(f'Unknown transport {transport}; using {TRANSPORT_PUBSUB}')
+            transport = TRANSPORT_PUBSUB
+        self._recorder = self._create_recorder(transport)
+        self.tracer = self._create_tracer()
+        self._worker_pool = self._create_worker_pool()
+        self._durable_queue = self._create_durable_queue()
+        self.transport = self._create_transport(transport, auth_token, broadcaster_id)
+        if self._durable_queue is not None:
+            self.obs.set_reconnect_callback(lambda _: self.transport.drain_durable_backlog())
+        return None
+
+    async def run(self) -> Optional[str]:
+        self._log_callback('Starting redemption monitoring...')
+        try:
+            err = await self.transport.run_tasks()
+            if err is not None:
+                self._log_callback(f'Twitch event client encountered an error: {err}')
+        finally:
+            # an exception out of the transport must still stop the supervisor's reconnect tasks
+            if self._recorder is not None:
+                self._recorder.close()
+            if self._worker_pool is not None:
+                await self._worker_pool.stop()
+            if self._durable_queue is not None:
+                self._durable_queue.close()
+            await self.obs.disconnect()
+            self._export_trace_percentiles()
+            self._log_suppressed_counts()
+            self._log_obs_latency_stats()
+        return err
+
+    async def disconnect_async(self):
+        if self.transport is not None:
+            await self.transport.disconnect_async()
+
+    def _create_recorder(self, transport: str) -> Optional[PubSubRecorder]:
+        record_path = self._config.get('record_path')
+        if not record_path:
+            return None
+        try:
+            recorder = PubSubRecorder(record_path, transport)
+        except (OSError, ValueError) as e:
+            self._log_callback(f'Unable to record {transport} traffic: {e}')
+            return None
+        self._log_callback(f'Recording {transport} traffic to {record_path}')
+        return recorder
+
+    def _create_tracer(self) -> Optional[RedemptionTracer]:
+        tracing_config = self._config.get('tracing')
+        if isinstance(tracing_config, dict):
+            return RedemptionTracer(**tracing_config)
+        elif tracing_config:
+            return RedemptionTracer()
+        return None
+
+    def _create_worker_pool(self) -> Optional[CallbackWorkerPool]:
+        worker_count = self._config.get('callback_workers', 0)
+        if not worker_count:
+            return None
+        worker_pool = CallbackWorkerPool(
+            self._config,
+            list(self.callbacks.list_callbacks().keys()),
+            self._log_callback,
+            worker_count=worker_count
+        )
+        worker_pool.start()
+        return worker_pool
+
+    def _create_durable_queue(self) -> Optional[DurableRedemptionQueue]:
+        try:
+            durable_queue = DurableRedemptionQueue.from_config(
+                self._config, list(self.callbacks.list_callbacks().keys()), self._log_callback,
+                obs_available=self.obs.is_available
+            )
+            if durable_queue is not None:
+                durable_queue.open()
+        except (sqlite3.Error, ValueError) as e:
+            self._log_callback(f'Unable to open the durable redemption queue: {e}')
+            return None
+        return durable_queue
+
+    def _create_transport(self, transport: str, auth_token: str, broadcaster_id: str) -> TwitchEventTransport:
+        if transport == TRANSPORT_EVENTSUB:
+            return TwitchEventSubClient(
+                TWITCH_TOPICS,
+                auth_token, self._config['client_id'], broadcaster_id,
+                self.callbacks.list_callbacks(),
+                self._log_callback,
+                tracer=self.tracer,
+                recorder=self._recorder,
+                admission_filters=self.callbacks.list_admission_filters(),
+                worker_pool=self._worker_pool,
+                durable_queue=self._durable_queue
+            )
+        return TwitchPubSubClient(
+            TWITCH_TOPICS,
+            auth_token, broadcaster_id,
+            self.callbacks.list_callbacks(),
+            self._log_callback,
+            heartbeat_rate=HEARTBEAT_RATE,
+            tracer=self.tracer,
+            recorder=self._recorder,
+            admission_filters=self.callbacks.list_admission_filters(),
+            worker_pool=self._worker_pool,
+            durable_queue=self._durable_queue
+        )
+
+    def _log_obs_latency_stats(self):
+        for name, stats in self.obs.latency_stats().items():
+            if stats['count'] == 0:
+                continue
+            self._log_callback(
+                f'OBS instance {name}: {stats["count"]} requests, '
+                f'mean {stats["mean"] * 1000:.1f}ms, p95 {stats["p95"] * 1000:.1f}ms, max {stats["max"] * 1000:.1f}ms'
+            )
+
+    def _log_suppressed_counts(self):
+        for reward_title, reasons in sorted(self.callbacks.get_suppressed_counts().items()):
+            summary = ', '.join(f'{count} by {reason}' for reason, count in sorted(reasons.items()))
+            self._log_callback(f'Suppressed redemptions of {reward_title}: {summary}')
+
+    def _export_trace_percentiles(self):
+        if self.tracer is None:
+            return
+        try:
+            path = self.tracer.export_percentiles()
+        except OSError as e:
+            self._log_callback(f'Unable to export redemption latency percentiles: {e}')
+            return
+        if path is not None:
+            self._log_callback(f'Exported redemption latency percentiles to {path}')
@@ -0,0 +1,166 @@
+from typing import Dict, List, Optional, Tuple, Iterable
+from collections import defaultdict, deque
+from datetime import datetime
+import contextvars
+import json
+import time
+from pubsub_events import PubSubEvent
+
+DEFAULT_PERCENTILES = (50, 90, 95, 99)
+
+_current_trace = contextvars.ContextVar('redemption_trace', default=None)
+
+
+def parse_redeemed_at(redeemed_at: Optional[str]) -> Optional[float]:
+    # twitch sends RFC3339 timestamps with up to nanosecond precision, which fromisoformat can't take
+    if not redeemed_at:
+        return None
+    stamp = redeemed_at.strip()
+    if stamp.endswith('Z'):
+        stamp = stamp[:-1] + '+00:00'
+    date_part, sep, frac = stamp.partition('.')
+    if sep:
+        digits = frac
+        offset = ''
+        for i, c in enumerate(frac):
+            if not c.isdigit():
+                digits, offset = frac[:i], frac[i:]
+                break
+        stamp = f'{date_part}.{digits[:6].ljust(6, "0")}{offset}'
+    try:
+        return datetime.fromisoformat(stamp).timestamp()
+    except ValueError:
+        return None
+
+
+class RedemptionTrace:
+    __slots__ = ('topic', 'reward_title', 'redeemed_at', 'spans', 'tracer')
+
+    def __init__(self, topic: str, reward_title: Optional[str], redeemed_at: Optional[float],
+                 tracer: Optional['RedemptionTracer'] = None):
+        self.topic = topic
+        self.reward_title = reward_title
+        self.redeemed_at = redeemed_at
+        self.spans = []  # type: List[Tuple[str, float]]
+        self.tracer = tracer  # the tracer that started this trace records it when it finishes
+
+    def mark(self, stage: str, timestamp: float = None):
+        self.spans.append((stage, time.time() if timestamp is None else timestamp))
+
+    def start_time(self) -> Optional[float]:
+        if self.redeemed_at is not None:
+            return self.redeemed_at
+        if len(self.spans) > 0:
+            return self.spans[0][1]
+        return None
+
+    def total_latency(self) -> Optional[float]:
+        start = self.start_time()
+        if start is None or len(self.spans) == 0:
+            return None
+        return self.spans[-1][1] - start
+
+    def to_dict(self) -> dict:
+        start = self.start_time()
+        return {
+            'topic': self.topic,
+            'reward_title': self.reward_title,
+            'redeemed_at': self.redeemed_at,
+            'total_latency': self.total_latency(),
+            'spans': [
+                {'stage': stage, 'timestamp': ts, 'offset': None if start is None else ts - start}
+                for stage, ts in self.spans
+            ]
+        }
+
+
+def mark_current(stage: str):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.mark(stage)
+
+
+class RedemptionTracer:
+    def __init__(self, slow_threshold: float = 2.0, slow_trace_path: str = None,
+                 percentiles_path: str = None, max_samples: int = 1000):
+        self._slow_threshold = slow_threshold
+        self._slow_trace_path = slow_trace_path
+        self._percentiles_path = percentiles_path
+        self._max_samples = max_samples
+        self._latencies = defaultdict(lambda: deque(maxlen=self._max_samples))  # type: Dict[str, deque]
+        self._slow_trace_count = 0
+
+    def start(self, topic: str, event: PubSubEvent, received_at: float) -> RedemptionTrace:
+        # only channel point events carry these, and reading them never forces a lazy decode
+        reward_title = getattr(event, 'reward_title', None)
+        redeemed_at = parse_redeemed_at(getattr(event, 'redeemed_at', None))
+        trace = RedemptionTrace(topic, reward_title, redeemed_at, self)
+        trace.mark('receive', received_at)
+        return trace
+
+    def activate(self, trace: RedemptionTrace) -> contextvars.Token:
+        return _current_trace.set(trace)
+
+    def deactivate(self, token: contextvars.Token):
+        _current_trace.reset(token)
+
+    def finish(self, trace: RedemptionTrace):
+        trace.mark('complete')
+        latency = trace.total_latency()
+        if latency is None:
+            return
+        key = trace.reward_title if trace.reward_title is not None else trace.topic
+        self._latencies[key].append(latency)
+        if latency >= self._slow_threshold:
+            self._slow_trace_count += 1
+            self._dump_slow_trace(trace)
+
+    def _dump_slow_trace(self, trace: RedemptionTrace):
+        if self._slow_trace_path is None:
+            return
+        try:
+            with open(self._slow_trace_path, 'a') as trace_file:
+                trace_file.write(json.dumps(trace.to_dict()) + '\n')
+        except OSError as e:
+            print(f'unable to write slow trace to {self._slow_trace_path}: {e}')
+
+    @staticmethod
+    def _percentile(sorted_values: List[float], percentile: float) -> float:
+        if len(sorted_values) == 1:
+            return sorted_values[0]
+        rank = (len(sorted_values) - 1) * percentile / 100
+        low = int(rank)
+        high = min(low + 1, len(sorted_values) - 1)
+        return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+    def _summarize(self, values: List[float], percentiles: Iterable[float]) -> dict:
+        values = sorted(values)
+        entry = {f'p{p:g}': self._percentile(values, p) for p in percentiles}
+        entry['count'] = len(values)
+        entry['max'] = values[-1]
+        return entry
+
+    def percentiles(self, percentiles: Iterable[float] = DEFAULT_PERCENTILES) -> Dict[str, dict]:
+        return {
+            key: self._summarize(samples, percentiles)
+            for key, samples in self._latencies.items() if len(samples) > 0
+        }
+
+    def overall_percentiles(self, percentiles: Iterable[float] = DEFAULT_PERCENTILES) -> Optional[dict]:
+        values = [v for samples in self._latencies.values() for v in samples]
+        if len(values) == 0:
+            return None
+        return self._summarize(values, percentiles)
+
+    def export_percentiles(self, path: str = None) -> Optional[str]:
+        path = path if path is not None else self._percentiles_path
+        if path is None:
+            return None
+        with open(path, 'w') as out_file:
+            json.dump({
+                'generated_at': time.time(),
+                'slow_threshold': self._slow_threshold,
+                'slow_trace_count': self._slow_trace_count,
+                'rewards': self.percentiles()
+            }, out_file, indent=2)
+        return path
@@ -0,0 +1,100 @@
+from typing import Dict, Optional
+from collections import defaultdict, deque
+import json
+import time
+
+
+class RewardPolicy:
+    # cooldown is measured from when a redemption is admitted, not from when its actions finish,
+    # so actions that run longer than the cooldown can be followed by the next redemption immediately;
+    # max_concurrency of 1 keeps runs from overlapping
+    def __init__(self, max_rate: int = None, rate_period: float = 60.0, cooldown: float = 0.0,
+                 max_concurrency: int = None, coalesce: bool = False):
+        self.max_rate = max_rate
+        self.rate_period = float(rate_period)
+        self.cooldown = float(cooldown)
+        self.max_concurrency = max_concurrency
+        self.coalesce = coalesce
+
+    @staticmethod
+    def parse_policies_from_file(actions_file) -> Dict[str, 'RewardPolicy']:
+        with open(actions_file) as a_file:
+            return RewardPolicy.parse_policies(json.load(a_file))
+
+    @staticmethod
+    def parse_policies(actions_obj: dict) -> Dict[str, 'RewardPolicy']:
+        policies = {}
+        for redemption_name, spec in actions_obj.items():
+            if not isinstance(spec, dict) or 'policy' not in spec:
+                continue
+            policy_spec = spec['policy']
+            if not isinstance(policy_spec, dict):
+                raise ValueError(f'Policy for "{redemption_name}" must be an object')
+            policies[redemption_name] = RewardPolicy(**policy_spec)
+        return policies
+
+
+class _RewardState:
+    __slots__ = ('admit_times', 'last_admit', 'active', 'pending', 'coalesced')
+
+    def __init__(self):
+        self.admit_times = deque()
+        self.last_admit = None  # type: Optional[float]
+        self.active = 0  # admitted runs that have not finished yet
+        self.pending = 0  # admitted runs that have not started yet
+        self.coalesced = 0  # duplicates folded into the pending run
+
+
+class RewardPolicyEnforcer:
+    def __init__(self, policies: Dict[str, RewardPolicy]):
+        self._policies = policies
+        self._states = defaultdict(_RewardState)  # type: Dict[str, _RewardState]
+        self._suppressed = defaultdict(lambda: defaultdict(int))  # type: Dict[str, Dict[str, int]]
+
+    def admit(self, reward_title: str) -> bool:
+        policy = self._policies.get(reward_title)
+        if policy is None:
+            return True
+        state = self._states[reward_title]
+        now = time.monotonic()
+        if policy.coalesce and state.pending > 0:
+            state.coalesced += 1
+            self._suppressed[reward_title]['coalesced'] += 1
+            return False
+        if state.last_admit is not None and now - state.last_admit < policy.cooldown:
+            self._suppressed[reward_title]['cooldown'] += 1
+            return False
+        if policy.max_rate is not None:
+            while len(state.admit_times) > 0 and now - state.admit_times[0] >= policy.rate_period:
+                state.admit_times.popleft()
+            if len(state.admit_times) >= policy.max_rate:
+                self._suppressed[reward_title]['rate'] += 1
+                return False
+        if policy.max_concurrency is not None and state.active >= policy.max_concurrency:
+            self._suppressed[reward_title]['concurrency'] += 1
+            return False
+        state.admit_times.append(now)
+        state.last_admit = now
+        state.active += 1
+        state.pending += 1
+        return True
+
+    def begin(self, reward_title: str) -> Optional[int]:
+        # returns how many redemptions this run stands for, or None if it was never admitted
+        if reward_title not in self._policies:
+            return None
+        state = self._states[reward_title]
+        if state.pending == 0:
+            return None
+        state.pending -= 1
+        count = 1 + state.coalesced
+        state.coalesced = 0
+        return count
+
+    def finish(self, reward_title: str):
+        state = self._states[reward_title]
+        if state.active > 0:
+            state.active -= 1
+
+    def suppressed_counts(self) -> Dict[str, Dict[str, int]]:
+        return {title: dict(reasons) for title, reasons in self._suppressed.items()}
@@ -0,0 +1,262 @@
+from typing import Dict, List, Optional
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+import websockets
+from pubsub_events import CHANNEL_POINTS_TOPIC
+from redemption_load_generator import build_redemption_frame, build_eventsub_frame, LOAD_TEST_CHANNEL_ID
+from twitch_pub_sub_client import TwitchPubSubClient
+from twitch_eventsub_client import TwitchEventSubClient
+
+BENCHMARK_HOST = 'localhost'
+BENCHMARK_TOPICS = [CHANNEL_POINTS_TOPIC + '.{channel_id}']
+BENCHMARK_REWARD = 'Benchmark'
+
+
+def _eventsub_session_frame(message_type: str, session: dict) -> str:
+    return json.dumps({
+        'metadata': {
+            'message_id': str(uuid.uuid4()),
+            'message_type': message_type,
+            'message_timestamp': datetime.now(timezone.utc).isoformat()
+        },
+        'payload': {'session': session} if session is not None else {}
+    })
+
+
+class _StandInServer(ABC):
+    # emulates just enough of a twitch endpoint to exercise a transport client locally
+    def __init__(self):
+        self.connection = None
+        self.client_frames = 0
+        self.client_bytes = 0
+        self.server_frames = 0
+        self.server_bytes = 0
+        self.heartbeat_frames = 0
+        self.connected = asyncio.Event()
+        self._server = None
+
+    async def start(self) -> int:
+        self._server = await websockets.serve(self.handler, BENCHMARK_HOST, 0)
+        return list(self._server.sockets)[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def send(self, frame: str, heartbeat: bool = False):
+        await self.connection.send(frame)
+        self.server_frames += 1
+        self.server_bytes += len(frame.encode('utf-8'))
+        if heartbeat:
+            self.heartbeat_frames += 1
+
+    def count_client_frame(self, frame: str):
+        self.client_frames += 1
+        self.client_bytes += len(frame.encode('utf-8') if isinstance(frame, str) else frame)
+
+    @abstractmethod
+    async def handler(self, websocket, path=None):
+        pass
+
+
+class _PubSubStandInServer(_StandInServer):
+    async def send_reconnect(self):
+        await self.send(json.dumps({'type': 'RECONNECT'}))
+
+    async def handler(self, websocket, path=None):
+        self.connection = websocket
+        try:
+            async for frame in websocket:
+                self.count_client_frame(frame)
+                message = json.loads(frame)
+                if message['type'] == 'LISTEN':
+                    await self.send(json.dumps({'type': 'RESPONSE', 'error': '', 'nonce': ''}))
+                    self.connected.set()
+                elif message['type'] == 'PING':
+                    await self.send(json.dumps({'type': 'PONG'}), heartbeat=True)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+
+class _EventSubStandInServer(_StandInServer):
+    def __init__(self, keepalive_timeout: int):
+        super().__init__()
+        self._keepalive_timeout = keepalive_timeout
+        self._session_id = str(uuid.uuid4())
+        self.port = None
+
+    async def start(self) -> int:
+        self.port = await super().start()
+        return self.port
+
+    def _session(self, status: str = 'connected', reconnect_url: Optional[str] = None) -> dict:
+        return {
+            'id': self._session_id,
+            'status': status,
+            'keepalive_timeout_seconds': self._keepalive_timeout if status == 'connected' else None,
+            'reconnect_url': reconnect_url
+        }
+
+    async def send_reconnect(self):
+        url = f'ws://{BENCHMARK_HOST}:{self.port}/?reconnect={self._session_id}'
+        await self.send(_eventsub_session_frame('session_reconnect', self._session('reconnecting', url)))
+
+    async def _keepalive(self):
+        while True:
+            await asyncio.sleep(self._keepalive_timeout)
+            await self.send(_eventsub_session_frame('session_keepalive', None), heartbeat=True)
+
+    async def handler(self, websocket, path=None):
+        self.connection = websocket
+        await self.send(_eventsub_session_frame('session_welcome', self._session()))
+        self.connected.set()
+        keepalive_task = asyncio.ensure_future(self._keepalive())
+        try:
+            async for frame in websocket:
+                self.count_client_frame(frame)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            keepalive_task.cancel()
+
+
+class _BenchmarkEventSubClient(TwitchEventSubClient):
+    # subscriptions are created over helix, which the stand-in server does not emulate
+    async def _create_subscriptions(self) -> Optional[str]:
+        return None
+
+
+class _DispatchCounter:
+    def __init__(self, expected: int):
+        self.count = 0
+        self._expected = expected
+        self.done = asyncio.Event()
+
+    def callback(self, data, user_ids):
+        self.count += 1
+        if self.count >= self._expected:
+            self.done.set()
+
+
+async def _time_callbacks(server: _StandInServer, counter: _DispatchCounter, frames: List[str]) -> float:
+    start = time.perf_counter()
+    for frame in frames:
+        await server.send(frame)
+    await counter.done.wait()
+    return time.perf_counter() - start
+
+
+async def _benchmark_pubsub(message_count: int, idle: float, heartbeat_rate: float) -> Dict[str, float]:
+    server = _PubSubStandInServer()
+    uri = f'ws://{BENCHMARK_HOST}:{await server.start()}'
+    counter = _DispatchCounter(message_count)
+    # twitch's minimum heartbeat rate is too slow to observe here
+    client = TwitchPubSubClient(
+        BENCHMARK_TOPICS, '', LOAD_TEST_CHANNEL_ID, {CHANNEL_POINTS_TOPIC: counter.callback}, print,
+        heartbeat_rate=heartbeat_rate, min_heartbeat_rate=0, uri=uri
+    )
+    run_task = asyncio.ensure_future(client.run_tasks())
+    await server.connected.wait()
+    frames = [build_redemption_frame(BENCHMARK_REWARD) for _ in range(message_count)]
+    elapsed = await _time_callbacks(server, counter, frames)
+    heartbeats_before_idle = server.client_frames
+    await asyncio.sleep(idle)
+    idle_heartbeats = server.client_frames - heartbeats_before_idle
+    # pubsub has no session to resume, so a RECONNECT pays a new socket plus a LISTEN round trip
+    server.connected.clear()
+    start = time.perf_counter()
+    await server.send_reconnect()
+    await server.connected.wait()
+    reconnect_time = time.perf_counter() - start
+    await client.disconnect_async()
+    await asyncio.wait([run_task], timeout=1)
+    await server.stop()
+    return {
+        'throughput': message_count / elapsed,
+        'bytes_per_message': sum(len(f.encode('utf-8')) for f in frames) / message_count,
+        'client_heartbeat_frames': idle_heartbeats,
+        'server_heartbeat_frames': server.heartbeat_frames,
+        'reconnect_time': reconnect_time
+    }
+
+
+async def _benchmark_eventsub(message_count: int, idle: float, keepalive_timeout: int) -> Dict[str, float]:
+    server = _EventSubStandInServer(keepalive_timeout)
+    uri = f'ws://{BENCHMARK_HOST}:{await server.start()}'
+    counter = _DispatchCounter(message_count)
+    client = _BenchmarkEventSubClient(
+        BENCHMARK_TOPICS, '', '', LOAD_TEST_CHANNEL_ID, {CHANNEL_POINTS_TOPIC: counter.callback}, print, uri=uri
+    )
+    run_task = asyncio.ensure_future(client.run_tasks())
+    await server.connected.wait()
+    frames = [build_eventsub_frame(BENCHMARK_REWARD) for _ in range(message_count)]
+    elapsed = await _time_callbacks(server, counter, frames)
+    client_frames_before_idle = server.client_frames
+    await asyncio.sleep(idle)
+    idle_heartbeats = server.client_frames - client_frames_before_idle
+    # a session_reconnect moves the existing subscriptions to a new socket without resubscribing
+    old_connection = server.connection
+    server.connected.clear()
+    start = time.perf_counter()
+    await server.send_reconnect()
+    await server.connected.wait()
+    await old_connection.wait_closed()
+    reconnect_time = time.perf_counter() - start
+    await client.disconnect_async()
+    await asyncio.wait([run_task], timeout=1)
+    await server.stop()
+    return {
+        'throughput': message_count / elapsed,
+        'bytes_per_message': sum(len(f.encode('utf-8')) for f in frames) / message_count,
+        'client_heartbeat_frames': idle_heartbeats,
+        'server_heartbeat_frames': server.heartbeat_frames,
+        'reconnect_time': reconnect_time
+    }
+
+
+def format_benchmark_report(results: Dict[str, Dict[str, float]], idle: float) -> List[str]:
+    lines = [f'{"":<10}{"msgs/s":>12}{"bytes/msg":>12}{"client hb":>12}{"server hb":>12}{"reconnect":>12}']
+    for transport, stats in results.items():
+        lines.append(
+            f'{transport:<10}{stats["throughput"]:>12.1f}{stats["bytes_per_message"]:>12.1f}'
+            f'{stats["client_heartbeat_frames"]:>12d}{stats["server_heartbeat_frames"]:>12d}'
+            f'{stats["reconnect_time"] * 1000:>10.2f}ms'
+        )
+    lines.append(f'client hb counts frames the client sent during the {idle:g}s idle window; '
+                 f'server hb counts PONGs/keepalives for the whole run')
+    lines.append('pubsub reconnect is a fresh socket plus LISTEN; eventsub reconnect is a session_reconnect '
+                 'migration (a lost eventsub session additionally pays one helix call per subscription)')
+    return lines
+
+
+async def _run_benchmark(message_count: int, idle: float, heartbeat_rate: float, keepalive_timeout: int):
+    results = {
+        'pubsub': await _benchmark_pubsub(message_count, idle, heartbeat_rate),
+        'eventsub': await _benchmark_eventsub(message_count, idle, keepalive_timeout)
+    }
+    for line in format_benchmark_report(results, idle):
+        print(line)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='compare the PubSub and EventSub transports against local stand-in servers')
+    parser.add_argument('--messages', type=int, default=5000, help='redemptions to push through each transport')
+    parser.add_argument('--idle', type=float, default=5, help='seconds to sit idle while counting heartbeat traffic')
+    parser.add_argument('--heartbeat-rate', type=float, default=1, help='seconds between pubsub PINGs')
+    parser.add_argument('--keepalive-timeout', type=int, default=1, help='seconds between eventsub keepalives')
+    result = vars(parser.parse_args(args))
+    if result['messages'] <= 0:
+        print('At least one message must be sent')
+        return 1
+    asyncio.run(_run_benchmark(result['messages'], result['idle'], result['heartbeat_rate'], result['keepalive_timeout']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,178 @@
+from typing import List, Callable, Optional, Dict, AsyncIterator, Tuple
+from abc import ABC, abstractmethod
+import asyncio
+import inspect
+from redemption_tracer import RedemptionTrace, RedemptionTracer
+from pubsub_events import PubSubEvent
+from pubsub_recording import PubSubRecorder, PubSubRecordingReader, throttled_frames
+from callback_worker_pool import CallbackWorkerPool
+from durable_redemption_queue import DurableRedemptionQueue
+
+
+class TwitchEventTransport(ABC):
+    # shared callback queue and dispatch; subclasses provide the socket protocol
+    TRANSPORT = None  # type: str
+    def __init__(self, callbacks: Dict[str, Callable[[PubSubEvent, List[int]], None]],
+                 log_callback: Callable[[str, ], None],
+                 tracer: Optional[RedemptionTracer] = None,
+                 recorder: Optional[PubSubRecorder] = None,
+                 admission_filters: Dict[str, Callable[[PubSubEvent, List[int]], bool]] = None,
+                 worker_pool: Optional[CallbackWorkerPool] = None,
+                 durable_queue: Optional[DurableRedemptionQueue] = None):
+        if recorder is not None and recorder.transport != self.TRANSPORT:
+            raise ValueError(f'Cannot record {self.TRANSPORT} frames into a {recorder.transport} recording')
+        self._callbacks = callbacks
+        self._log_callback = log_callback
+        self._callback_queue = asyncio.Queue()
+        self._callback_task = None  # type: asyncio.Task
+        self._tracer = tracer
+        # dispatch_frames swaps these for the duration of one synchronous _handle_frame call
+        self._frame_tracer = tracer
+        self._frame_durable = True
+        self._recorder = recorder
+        self._admission_filters = admission_filters if admission_filters is not None else {}
+        self._worker_pool = worker_pool
+        self._durable_queue = durable_queue
+        self._drain_task = None  # type: asyncio.Task
+
+    @abstractmethod
+    async def disconnect_async(self):
+        pass
+
+    @abstractmethod
+    async def run_tasks(self, reconnect_retries: int = 6) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def _handle_frame(self, frame: str, received_at: float) -> Optional[str]:
+        pass
+
+    def _start_callback_task(self):
+        if self._callback_task is None:
+            self._callback_task = asyncio.create_task(self._process_callbacks(self._callback_queue))
+            self.drain_durable_backlog()
+
+    def _stop_callback_task(self):
+        if self._drain_task is not None:
+            self._drain_task.cancel()
+            self._drain_task = None
+        if self._callback_task is not None:
+            self._callback_queue.put_nowait((None, None, None, None, None))
+
+    def drain_durable_backlog(self):
+        # called on startup and whenever OBS comes back, to retry what is still stored
+        if self._durable_queue is None or self._callback_task is None:
+            return
+        if self._drain_task is not None and not self._drain_task.done():
+            return
+        backlog = self._durable_queue.backlog()
+        if len(backlog) > 0:
+            self._drain_task = asyncio.ensure_future(self._durable_queue.drain(backlog, self._resubmit))
+
+    def _resubmit(self, entry_id: int, topic: str, event: PubSubEvent, user_ids: List[int]):
+        # stored entries were admitted when they arrived, so they skip the admission filters
+        callback = self._callbacks.get(topic)
+        if callback is None:
+            self._durable_queue.ack(entry_id)
+            return
+        self._callback_queue.put_nowait((callback, event, user_ids, None, entry_id))
+
+    def _record(self, frame: str, received_at: float):
+        if self._recorder is not None:
+            self._recorder.write(frame, received_at)
+
+    def _enqueue(self, topic: str, event: PubSubEvent, user_ids: List[int], received_at: float):
+        if self._worker_pool is not None and self._worker_pool.handles(topic):
+            # the worker owning the reward runs its own admission filter next to its policy state
+            trace = None
+            if self._frame_tracer is not None:
+                trace = self._frame_tracer.start(topic, event, received_at)
+            self._worker_pool.submit(event, user_ids, trace)
+            return
+        admit = self._admission_filters.get(topic)
+        if admit is not None and not admit(event, user_ids):
+            return
+        trace = None
+        if self._frame_tracer is not None:
+            trace = self._frame_tracer.start(topic, event, received_at)
+            trace.mark('enqueue')
+        entry_id = None
+        if self._frame_durable and self._durable_queue is not None and self._durable_queue.handles(topic):
+            entry_id = self._durable_queue.put(topic, event, user_ids, received_at)
+        self._callback_queue.put_nowait(
+            (self._callbacks[topic], event, user_ids, trace, entry_id)
+        )
+
+    async def _process_callbacks(self, queue: asyncio.Queue):
+        while True:
+            callback, data, user_ids, trace, entry_id = await queue.get()
+            if callback is None:
+                queue.task_done()
+                return
+            try:
+                err_msg = await self._run_callback(callback, data, user_ids, trace)
+                if entry_id is not None:
+                    if err_msg is None:
+                        self._durable_queue.ack(entry_id)
+                    else:
+                        self._durable_queue.fail(entry_id)
+                if err_msg is not None:
+                    self._log_callback(f'Encountered error processing action: {err_msg}')
+            finally:
+                queue.task_done()
+
+    async def _run_callback(self, callback: Callable[[PubSubEvent, List[int]], Optional[str]],
+                            data: PubSubEvent, user_ids: List[int],
+                            trace: Optional[RedemptionTrace]) -> Optional[str]:
+        # a raising callback is reported like an action error so the consumer task keeps running
+        trace_token = None
+        if trace is not None:
+            trace.mark('dequeue')
+            trace_token = trace.tracer.activate(trace)
+        try:
+            if inspect.iscoroutinefunction(callback):
+                return await callback(data, user_ids)
+            return callback(data, user_ids)
+        except Exception as e:
+            return f'{type(e).__name__}: {e}'
+        finally:
+            if trace is not None:
+                trace.tracer.deactivate(trace_token)
+                trace.tracer.finish(trace)
+
+    def pending_callbacks(self) -> int:
+        if self._worker_pool is not None:
+            return self._callback_queue.qsize() + self._worker_pool.pending_callbacks()
+        return self._callback_queue.qsize()
+
+    async def dispatch_frames(self, frames: AsyncIterator[Tuple[float, str]],
+                              tracer: Optional[RedemptionTracer] = None, durable: bool = True) -> int:
+        # feeds frames through the same parse/route/dispatch path as the live socket; tracer replaces the
+        # transport's own for these frames, and durable=False keeps them out of the durable queue
+        owns_callback_task = self._callback_task is None
+        self._start_callback_task()
+        frame_count = 0
+        try:
+            async for received_at, frame in frames:
+                # _handle_frame never awaits, so live frames cannot arrive while the overrides are in place
+                self._frame_tracer = tracer if tracer is not None else self._tracer
+                self._frame_durable = durable
+                try:
+                    self._handle_frame(frame, received_at)
+                finally:
+                    self._frame_tracer = self._tracer
+                    self._frame_durable = True
+                frame_count += 1
+            await self._callback_queue.join()
+        finally:
+            if owns_callback_task:
+                self._stop_callback_task()
+                await self._callback_task
+                self._callback_task = None
+        return frame_count
+
+    async def replay_recording(self, recording_path: str, speed: Optional[float] = 1.0) -> int:
+        reader = PubSubRecordingReader(recording_path)
+        if reader.transport != self.TRANSPORT:
+            raise ValueError(f'{recording_path} holds {reader.transport} frames, not {self.TRANSPORT}')
+        return await self.dispatch_frames(throttled_frames(reader, speed))
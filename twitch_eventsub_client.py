@@ -0,0 +1,223 @@
+from typing import List, Callable, Optional, Dict
+from collections import deque
+import websockets
+from websockets import client as wsclient
+from websockets.client import WebSocketClientProtocol
+import json
+import asyncio
+import time
+import requests
+from helix_api_manager import HelixAPIManager
+from redemption_tracer import RedemptionTracer
+from pubsub_events import PubSubEvent, CHANNEL_POINTS_TOPIC, BITS_TOPIC, SUBSCRIPTION_TOPIC, TRANSPORT_EVENTSUB
+from pubsub_recording import PubSubRecorder
+from twitch_event_transport import TwitchEventTransport
+from callback_worker_pool import CallbackWorkerPool
+from durable_redemption_queue import DurableRedemptionQueue
+
+TWITCH_EVENTSUB_URI = 'wss://eventsub.wss.twitch.tv/ws'
+WELCOME_TIMEOUT = 10
+KEEPALIVE_GRACE = 5  # seconds past the server keepalive timeout before the session counts as dead
+WS_CLOSE_TIMEOUT = 1
+SEEN_MESSAGE_IDS = 256
+
+# callback topic -> (EventSub subscription type, version)
+EVENTSUB_SUBSCRIPTIONS = {
+    CHANNEL_POINTS_TOPIC: ('channel.channel_points_custom_reward_redemption.add', '1'),
+    BITS_TOPIC: ('channel.cheer', '1'),
+    SUBSCRIPTION_TOPIC: ('channel.subscribe', '1')
+}
+
+
+class TwitchEventSubClient(TwitchEventTransport):
+    TRANSPORT = TRANSPORT_EVENTSUB
+
+    def __init__(self, topics: List[str], auth_token: str, client_id: str, broadcaster_id: str,
+                 callbacks: Dict[str, Callable[[PubSubEvent, List[int]], None]],
+                 log_callback: Callable[[str, ], None],
+                 tracer: Optional[RedemptionTracer] = None,
+                 recorder: Optional[PubSubRecorder] = None,
+                 admission_filters: Dict[str, Callable[[PubSubEvent, List[int]], bool]] = None,
+                 worker_pool: Optional[CallbackWorkerPool] = None,
+                 durable_queue: Optional[DurableRedemptionQueue] = None,
+                 uri: str = TWITCH_EVENTSUB_URI):
+        super().__init__(
+            callbacks, log_callback, tracer, recorder, admission_filters, worker_pool, durable_queue
+        )
+        # topics use the PubSub names (e.g. channel-points-channel-v1.{channel_id}) so both transports share config
+        self._topics = [t.partition('.')[0] for t in topics]
+        self._auth_token = auth_token
+        self._client_id = client_id
+        self._broadcaster_id = broadcaster_id
+        self._uri = uri
+        self._topic_by_type = {sub_type: topic for topic, (sub_type, _) in EVENTSUB_SUBSCRIPTIONS.items()}
+        self._connection = None  # type: Optional[WebSocketClientProtocol]
+        self._session_id = None  # type: Optional[str]
+        self._keepalive_timeout = None  # type: Optional[float]
+        self._reconnect_url = None  # type: Optional[str]
+        self._seen_message_ids = deque(maxlen=SEEN_MESSAGE_IDS)
+        self._closing = False
+
+    async def _open_session(self, uri: str) -> Optional[WebSocketClientProtocol]:
+        try:
+            connection = await wsclient.connect(uri, close_timeout=WS_CLOSE_TIMEOUT)
+            frame = await asyncio.wait_for(connection.recv(), WELCOME_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+            print(f'unable to open twitch eventsub session: {e}')
+            return None
+        received_at = time.time()
+        self._record(frame, received_at)
+        if self._handle_frame(frame, received_at) != 'session_welcome':
+            print('twitch eventsub session did not start with a welcome message')
+            await connection.close()
+            return None
+        return connection
+
+    def _create_subscription(self, manager: HelixAPIManager, topic: str) -> Optional[str]:
+        sub_type, version = EVENTSUB_SUBSCRIPTIONS[topic]
+        try:
+            manager.create_eventsub_subscription(
+                sub_type, version, {'broadcaster_user_id': str(self._broadcaster_id)}, self._session_id
+            )
+        except (RuntimeError, requests.RequestException) as e:
+            return f'Unable to subscribe to {sub_type}: {e}'
+        return None
+
+    async def _create_subscriptions(self) -> Optional[str]:
+        # helix has no batch endpoint, so every subscription is requested at once over one api session
+        loop = asyncio.get_running_loop()
+        topics = [t for t in self._topics if t in EVENTSUB_SUBSCRIPTIONS]
+        with HelixAPIManager(client_id=self._client_id, user_token=self._auth_token) as manager:
+            errors = await asyncio.gather(*(
+                loop.run_in_executor(None, self._create_subscription, manager, topic) for topic in topics
+            ))
+        errors = [e for e in errors if e is not None]
+        if len(errors) > 0:
+            return '; '.join(errors)
+        return None
+
+    async def _connect(self) -> Optional[str]:
+        self._connection = await self._open_session(self._uri)
+        if self._connection is None:
+            return 'Unable to connect to twitch EventSub endpoint'
+        err = await self._create_subscriptions()
+        if err is not None:
+            await self._connection.close()
+            self._connection = None
+            return err
+        return None
+
+    async def _migrate_session(self) -> bool:
+        # subscriptions follow the session to the reconnect url, so nothing is resubscribed
+        reconnect_url, self._reconnect_url = self._reconnect_url, None
+        new_connection = await self._open_session(reconnect_url)
+        if new_connection is None:
+            return False
+        old_connection, self._connection = self._connection, new_connection
+        await old_connection.close()
+        return True
+
+    async def disconnect_async(self):
+        self._closing = True
+        self._stop_callback_task()
+        try:
+            if self._connection is not None:
+                await self._connection.close()
+            if self._callback_task is not None:
+                await self._callback_task
+        finally:
+            self._connection = None
+            self._callback_task = None
+
+    def _handle_frame(self, frame: str, received_at: float) -> Optional[str]:
+        message = json.loads(frame)
+        try:
+            metadata = message['metadata']
+            message_type = metadata['message_type']
+            payload = message['payload']
+        except (KeyError, TypeError) as e:
+            print(f'malformed eventsub message from twitch: {e}')
+            return None
+        if message_type == 'notification':
+            message_id = metadata.get('message_id')
+            if message_id is not None:
+                if message_id in self._seen_message_ids:  # twitch may redeliver a notification
+                    return message_type
+                self._seen_message_ids.append(message_id)
+            topic = self._topic_by_type.get(metadata.get('subscription_type'))
+            if topic in self._callbacks:
+                try:
+                    event = payload['event']
+                    user_ids = [int(event['broadcaster_user_id'])]
+                    self._enqueue(topic, PubSubEvent.from_eventsub(topic, user_ids, event), user_ids, received_at)
+                except (KeyError, TypeError, ValueError) as e:
+                    print(f'malformed {topic} notification from twitch: {e}')
+                    return None
+        elif message_type == 'session_welcome':
+            session = payload['session']
+            self._session_id = session['id']
+            self._keepalive_timeout = session.get('keepalive_timeout_seconds')
+        elif message_type == 'session_reconnect':
+            self._reconnect_url = payload['session']['reconnect_url']
+        elif message_type == 'revocation':
+            sub_type = payload.get('subscription', {}).get('type')
+            self._log_callback(f'Twitch revoked the EventSub subscription for {sub_type}')
+        elif message_type != 'session_keepalive':
+            print(f'Encountered unknown eventsub message type {message_type}')
+        return message_type
+
+    async def _receive_loop(self) -> bool:
+        # returns True if the loop ended because of a requested disconnect
+        while not self._closing:
+            timeout = None
+            if self._keepalive_timeout is not None:
+                timeout = self._keepalive_timeout + KEEPALIVE_GRACE
+            try:
+                frame = await asyncio.wait_for(self._connection.recv(), timeout)
+            except asyncio.TimeoutError:
+                print('no eventsub message or keepalive within the keepalive timeout')
+                return False
+            except websockets.exceptions.ConnectionClosed:
+                print('exited eventsub receive loop due to disconnect')
+                return self._closing
+            received_at = time.time()
+            self._record(frame, received_at)
+            message_type = self._handle_frame(frame, received_at)
+            if message_type == 'session_reconnect' and self._reconnect_url is not None:
+                print('Got session reconnect from twitch; moving to the new session...')
+                if not await self._migrate_session():
+                    return False
+        return True
+
+    async def _reconnect(self, max_tries: int) -> Optional[str]:
+        # the session is gone, so a fresh one needs its subscriptions created again
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+        wait_time = 1
+        err = 'no reconnect attempts allowed'
+        for _ in range(max_tries):
+            print(f'attempting to open a new eventsub session in {wait_time} seconds')
+            await asyncio.sleep(wait_time)
+            if self._closing:
+                return None
+            err = await self._connect()
+            if err is None:
+                return None
+            wait_time *= 2  # exponential backoff
+        return err
+
+    async def run_tasks(self, reconnect_retries: int = 6) -> Optional[str]:
+        self._closing = False
+        err = await self._connect()
+        if err is not None:
+            return err
+        self._start_callback_task()
+        while not await self._receive_loop():
+            err = await self._reconnect(reconnect_retries)
+            if self._closing:
+                break
+            if err is not None:
+                await self.disconnect_async()
+                return f'Unable to reconnect to twitch EventSub endpoint: {err}'
+        return None
@@ -1,40 +1,58 @@
 
-from concurrent.futures import CancelledError
 from typing import List, Callable, Optional, Dict
 import websockets
 from websockets import client as wsclient
 from websockets.client import WebSocketClientProtocol
 import json
 import asyncio
-import inspect
+import time
+from redemption_tracer import RedemptionTracer
+from pubsub_events import PubSubEvent, TRANSPORT_PUBSUB
+from pubsub_recording import PubSubRecorder
+from twitch_event_transport import TwitchEventTransport
+from callback_worker_pool import CallbackWorkerPool
+from durable_redemption_queue import DurableRedemptionQueue
 
 TWITCH_WEBSOCKET_URI = 'wss://pubsub-edge.twitch.tv'
 PONG_TIMEOUT = 10
+MIN_HEARTBEAT_RATE = 20
 WS_CLOSE_TIMEOUT = 1
 
 
-class TwitchPubSubClient:
+class TwitchPubSubClient(TwitchEventTransport):
+    TRANSPORT = TRANSPORT_PUBSUB
+
     def __init__(self, topics: List[str], auth_token: str, broadcaster_id: str, 
-                 callbacks: Dict[str, Callable[[dict, List[int]], None]], 
+                 callbacks: Dict[str, Callable[[PubSubEvent, List[int]], None]], 
                  log_callback: Callable[[str, ], None],
-                 heartbeat_rate: float = 60):
+                 heartbeat_rate: float = 60,
+                 min_heartbeat_rate: float = MIN_HEARTBEAT_RATE,
+                 tracer: Optional[RedemptionTracer] = None,
+                 recorder: Optional[PubSubRecorder] = None,
+                 admission_filters: Dict[str, Callable[[PubSubEvent, List[int]], bool]] = None,
+                 worker_pool: Optional[CallbackWorkerPool] = None,
+                 durable_queue: Optional[DurableRedemptionQueue] = None,
+                 uri: str = TWITCH_WEBSOCKET_URI):
+        super().__init__(
+            callbacks, log_callback, tracer, recorder, admission_filters, worker_pool, durable_queue
+        )
         self._topics = topics
         self._auth_token = auth_token
         self._broadcaster_id = broadcaster_id
-        self._asyncio_loop = None
+        self._uri = uri
         self._connection = None  # type: Optional[WebSocketClientProtocol]
-        self._callbacks = callbacks
-        self._log_callback = log_callback
-        self._heartbeat_rate = heartbeat_rate if heartbeat_rate >= 20 else 20 # set 20 as minimum 
+        self._heartbeat_rate = max(heartbeat_rate, min_heartbeat_rate)
         self._heartbeat_event = asyncio.Event()
         self._heartbeat_abort = asyncio.Event()
-        self._callback_queue = asyncio.Queue()
-        self._callback_task = None  # type: asyncio.Task
         self._heartbeat_task = None  # type: asyncio.Task
         self._receive_task = None  # type: asyncio.Task
 
     async def _connect(self):
-        self._connection = await wsclient.connect(TWITCH_WEBSOCKET_URI, close_timeout=WS_CLOSE_TIMEOUT)
+        try:
+            self._connection = await wsclient.connect(self._uri, close_timeout=WS_CLOSE_TIMEOUT)
+        except (OSError, websockets.exceptions.WebSocketException) as e:
+            print(f'unable to connect to twitch pubsub endpoint: {e}')
+            return False
         if not self._connection.open:
             self._connection = None
             print('unable to connect to twitch pubsub endpoint')
@@ -53,57 +71,34 @@ class TwitchPubSubClient:
             self._connection = None
             print('Got error subscribing on pubsub endpoint')
             return False
-        self._callback_task = asyncio.create_task(self._process_callbacks(self._callback_queue))
+        self._start_callback_task()
         return True
 
-    def disconnect(self):
-        if self._asyncio_loop is not None:
-            fut = asyncio.run_coroutine_threadsafe(self._disconnect_async(), self._asyncio_loop)
-            try:
-                fut.result()
-            except (asyncio.CancelledError, CancelledError):
-                print('disconnect future cancelled')
-
-    async def _disconnect_async(self):
-        if self._callback_task is not None:
-            self._callback_queue.put_nowait((None, None, None))
+    async def _close_connection(self):
+        # ends the socket and its heartbeat; the callback queue keeps running across a reconnect
         if self._heartbeat_task is not None:
-            self._heartbeat_abort.set()
-            self._heartbeat_event.set()
+            self._heartbeat_task.cancel()
+        if self._connection is not None and self._connection.open:
+            await self._connection.close()
+        self._connection = None
+        to_wait = [t for t in (self._receive_task, self._heartbeat_task) if t is not None]
+        if len(to_wait) > 0:
+            await asyncio.wait(to_wait)
+        self._receive_task = None
+        self._heartbeat_task = None
+
+    async def disconnect_async(self):
+        self._heartbeat_abort.set()
+        self._heartbeat_event.set()
+        self._stop_callback_task()
         try:
-            if self._connection is not None and self._connection.open:
-                await self._connection.close()
-                self._connection = None
-            to_wait = [self._callback_task, self._receive_task, self._heartbeat_task]
-            to_wait = [t for t in to_wait if t is not None]
-            if len(to_wait) > 0:
-                await asyncio.wait(to_wait)
-        except asyncio.CancelledError as e:
-            print('?')
-        except Exception as e:
-            print('huh?')
+            await self._close_connection()
+            if self._callback_task is not None:
+                await self._callback_task
         finally:
-            self._asyncio_loop = None
-            self._receive_task = None
             self._callback_task = None
-            self._heartbeat_task = None
-
-    async def _process_callbacks(self, queue: asyncio.Queue):
-        while True:
-            callback, data, user_ids = await queue.get()
-            if callback is None:
-                queue.task_done()
-                return
-            if inspect.iscoroutinefunction(callback):
-                err_msg = await callback(data, user_ids)
-            else:
-                err_msg = callback(data, user_ids)
-            if err_msg is not None:
-                self._log_callback(f'Encountered error processing action: {err_msg}')
-            queue.task_done()
 
     async def _heartbeat(self):
-        self._heartbeat_abort.clear()
         to_send = json.dumps({'type': 'PING'})
         while not self._heartbeat_task.cancelled():
             try:
@@ -125,79 +120,81 @@ class TwitchPubSubClient:
                 return
     
     async def _reconnect(self, max_tries: int = -1):
+        # runs from run_tasks rather than the receive loop, so closing the old socket never waits on itself
         wait_time = 1
         tries = 0
         if max_tries < 0:
             max_tries = float('inf')
-        await self._disconnect_async()
-        while not await self._connect() and tries < max_tries:
+        await self._close_connection()
+        while not self._heartbeat_abort.is_set() and not await self._connect() and tries < max_tries:
             print(f'failed on reconnect; attempting again in {wait_time} seconds')
             await asyncio.sleep(wait_time)
             wait_time *= 2  # exponential backoff
             tries += 1
-        if max_tries < 0:
-            return True
-        else:
-            return tries < max_tries
+        return tries < max_tries
+
+    def _handle_frame(self, frame: str, received_at: float) -> Optional[str]:
+        event = json.loads(frame)
+        if 'type' not in event:
+            print('got improperly formatted event')
+            return None
+        event_type = event['type']
+        if event_type == 'MESSAGE':
+            try:
+                data = event['data']
+                topic = data['topic']
+                user_ids = []
+                while '.' in topic:
+                    topic, _, user_id = topic.partition('.')
+                    user_ids.append(int(user_id))
+            except (KeyError, ValueError) as e:
+                print(f'malformed message from twitch: {e}')
+                return None
+            if topic in self._callbacks:
+                try:
+                    message = PubSubEvent.from_message(topic, user_ids, data['message'])
+                except (KeyError, ValueError) as e:
+                    print(f'malformed {topic} message from twitch: {e}')
+                    return None
+                self._enqueue(topic, message, user_ids, received_at)
+        elif event_type == 'PONG':
+            self._heartbeat_event.set()
+        elif event_type != 'RECONNECT':
+            print(f'Encountered unknown message type {event_type}: {event}')
+        return event_type
 
-    async def _receive_loop(self):
+    async def _receive_loop(self) -> bool:
+        # returns True if twitch asked for a reconnect
         try:
-            async for event in self._connection:
-                event = json.loads(event)
-                if 'type' not in event:
-                    print('got improperly formatted event')
-                    continue
-                event_type = event['type']
-                if event_type == 'RECONNECT':
+            async for frame in self._connection:
+                received_at = time.time()
+                self._record(frame, received_at)
+                if self._handle_frame(frame, received_at) == 'RECONNECT':
                     print('Got explicit reconnect message from twitch; reconnecting...')
-                    await self._reconnect()
-                elif event_type == 'MESSAGE':
-                    try:
-                        data = event['data']
-                        topic = data['topic']
-                        user_ids = []
-                        while '.' in topic:
-                            topic, _, user_id = topic.partition('.')
-                            user_ids.append(int(user_id))
-                    except (KeyError, ValueError) as e:
-                        print(f'malformed message from twitch: {e}')
-                        continue
-                    if topic in self._callbacks:
-                        self._callback_queue.put_nowait(
-                            (self._callbacks[topic], json.loads(data['message']), user_ids)
-                        )
-                elif event_type == 'PONG':
-                    self._heartbeat_event.set()
-                else:
-                    print(f'Encountered unknown message type {event_type}: {event}')
+                    return True
         except websockets.exceptions.ConnectionClosed as e:
             print('exited receive loop due to disconnect')
-            return
-    
+        return False
+
     async def run_tasks(self, reconnect_retries: int = 6):
+        self._heartbeat_abort.clear()
         if not await self._connect():
             return 'Unable to connect to twitch PubSub endpoint'
-        self._asyncio_loop = asyncio.get_running_loop()
-        self._heartbeat_task = asyncio.ensure_future(self._heartbeat())
-        self._receive_task = asyncio.ensure_future(self._receive_loop())
-        tasks = [self._heartbeat_task, self._receive_task]
         while True:
-            _, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            heartbeat_task = self._heartbeat_task = asyncio.ensure_future(self._heartbeat())
+            receive_task = self._receive_task = asyncio.ensure_future(self._receive_loop())
+            await asyncio.wait([heartbeat_task, receive_task], return_when=asyncio.FIRST_COMPLETED)
             if self._heartbeat_abort.is_set():
                 break
-            if self._receive_task in pending:  # heartbeat failure case
+            if receive_task.done() and not receive_task.result():  # receive task failure case
+                await self._close_connection()
+                break
+            if not receive_task.done():  # heartbeat failure case
                 print('failed heartbeat check; attempting to reconnect')
-                if not await self._reconnect(max_tries=reconnect_retries):
-                    print('unable to reconnect, exiting')
-                    self._disconnect()
-                    for task in pending:
-                        asyncio.wait([task])
-                    return 'Unable to reconnect to twitch PubSub endpoint'
-                tasks = [
-                    self._receive_task,
-                    asyncio.ensure_future(self._heartbeat())
-                ]
-            else:  # receive task failure case
+            if not await self._reconnect(max_tries=reconnect_retries):
+                print('unable to reconnect, exiting')
+                await self.disconnect_async()
+                return 'Unable to reconnect to twitch PubSub endpoint'
+            if self._heartbeat_abort.is_set():
                 break
         return None
-        
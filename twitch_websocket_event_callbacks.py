@@ -1,30 +1,62 @@
 
-from typing import Callable, Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Union
 from obs_websocket_executor import OBSWebsocketExecutor
+from obs_supervisor import OBSSupervisor
 from actions import Action
+from pubsub_events import PubSubEvent, ChannelPointsRedemptionEvent, CHANNEL_POINTS_TOPIC
+from reward_policy import RewardPolicy, RewardPolicyEnforcer
 
 class TwitchWebsocketEventCallbacks:
-    def __init__(self, ws_executor: OBSWebsocketExecutor, 
+    def __init__(self, ws_executor: Union[OBSWebsocketExecutor, OBSSupervisor], 
                  channel_points_redemption_actions: Dict[str, List[Action]],
-                 log_callback: Callable[[str,], None]):
+                 log_callback: Callable[[str,], None],
+                 reward_policies: Optional[Dict[str, RewardPolicy]] = None):
         self._ws_executor = ws_executor
         self._channel_points_redemption_actions = channel_points_redemption_actions
         self._log_callback = log_callback
+        self._policy_enforcer = RewardPolicyEnforcer(reward_policies if reward_policies is not None else {})
 
     async def connect(self):
         return await self._ws_executor.connect()
 
-    async def handle_redemption_reward(self, reward: dict, user_ids: List[int]):
-        reward = reward['data']['redemption']['reward']
-        reward_title = reward['title']
-        if reward_title in self._channel_points_redemption_actions:
+    def admit_redemption_reward(self, event: ChannelPointsRedemptionEvent, user_ids: List[int]) -> bool:
+        return self._policy_enforcer.admit(event.reward_title)
+
+    async def handle_redemption_reward(self, event: ChannelPointsRedemptionEvent, user_ids: List[int]):
+        reward_title = event.reward_title
+        run_count = self._policy_enforcer.begin(reward_title)
+        try:
+            return await self._run_actions(reward_title, run_count)
+        finally:
+            if run_count is not None:
+                self._policy_enforcer.finish(reward_title)
+
+    async def test_redemption_reward(self, reward_title: str) -> Optional[str]:
+        # bypasses the reward policies so a test neither gets suppressed nor consumes an admitted run
+        return await self._run_actions(reward_title, None)
+
+    async def _run_actions(self, reward_title: str, run_count: Optional[int]) -> Optional[str]:
+        if reward_title not in self._channel_points_redemption_actions:
+            return None
+        if run_count is not None and run_count > 1:
+            self._log_callback(f'Executing action for {reward_title} ({run_count} redemptions coalesced)')
+        else:
             self._log_callback(f'Executing action for {reward_title}')
-            for action in self._channel_points_redemption_actions[reward_title]:
-                err = await action.execute(self._ws_executor)
-                if err is not None:
-                    return err
+        for action in self._channel_points_redemption_actions[reward_title]:
+            err = await action.execute(self._ws_executor)
+            if err is not None:
+                return err
+        return None
+
+    def get_suppressed_counts(self) -> Dict[str, Dict[str, int]]:
+        return self._policy_enforcer.suppressed_counts()
     
-    def list_callbacks(self) -> Dict[str, Callable[[dict, List[int]], Optional[str]]]:
+    def list_callbacks(self) -> Dict[str, Callable[[PubSubEvent, List[int]], Optional[str]]]:
+        return {
+            CHANNEL_POINTS_TOPIC: self.handle_redemption_reward
+        }
+
+    def list_admission_filters(self) -> Dict[str, Callable[[PubSubEvent, List[int]], bool]]:
         return {
-            'channel-points-channel-v1': self.handle_redemption_reward
+            CHANNEL_POINTS_TOPIC: self.admit_redemption_reward
         }
\ No newline at end of file